@@ -4,4 +4,7 @@ import sys
 sys.path.append('.')
 
 from make_ebook import cli
-cli.main()
+
+# the MOBI writer compresses in worker processes, which may re-import this
+if __name__ == "__main__":
+    cli.main()
@@ -1,3 +1,4 @@
 from . import formats, sites
 
 from .sites import get_story
+from .stream import aiter_chapters, iter_chapters
@@ -0,0 +1,270 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import os
+import re
+import shutil
+import sys
+
+from .checkpoint import Job, Unsaved, checkpointed, default_job_dir
+from .formats import writers
+from .metrics import metrics
+from .model import compile_story
+from .sites import get_site, get_story
+from .volumes import split_story, volume_name
+
+
+def already_built(out_name, move_to=None, formats=("mobi",)):
+    return all(
+        os.path.exists(os.path.join(move_to or "", "{}.{}".format(out_name, fmt)))
+        for fmt in formats
+    )
+
+
+def write_book(story, formats=("mobi",), pool=None, **kwargs):
+    """
+    Writes a compiled story in each of formats at once; returns their paths.
+    """
+    if len(formats) == 1:
+        return [writers[formats[0]](story, pool=pool, **kwargs)]
+    with ThreadPoolExecutor(max_workers=len(formats)) as threads:
+        futures = [
+            threads.submit(writers[fmt], story, pool=pool, **kwargs) for fmt in formats
+        ]
+        return [f.result() for f in futures]
+
+
+def build_volumes(
+    story, out_name=None, move_to=None, split=None, update=False, formats=("mobi",)
+):
+    """
+    Renders story as volumes of at most `split` chapters or bytes, in each of
+    formats, in parallel.
+
+    With update, volumes before the last one already built are left alone,
+    and that one is updated in place if the format can.
+    """
+    story = compile_story(story)
+    if out_name is None:
+        out_name = story.default_out_name
+    volumes = split_story(story, split)
+    names = [volume_name(out_name, i) for i in range(1, len(volumes) + 1)]
+
+    start = 0
+    if update:
+        built = [
+            i for i, name in enumerate(names) if already_built(name, move_to, formats)
+        ]
+        start = built[-1] if built else 0
+        for name in names[:start]:
+            print("Keeping {}".format(name), file=sys.stderr)
+
+    todo = [
+        (v, name, fmt)
+        for v, name in list(zip(volumes, names))[start:]
+        for fmt in formats
+    ]
+    if not todo:
+        return []
+    threads = min(len(todo), os.cpu_count() or 1)
+    with ProcessPoolExecutor() as procs:
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            futures = [
+                pool.submit(
+                    writers[fmt],
+                    v,
+                    out_name=name,
+                    move_to=move_to,
+                    pool=procs,
+                    update=update,
+                )
+                for v, name, fmt in todo
+            ]
+            return [f.result() for f in futures]
+
+
+def job_dir_for(url, select=None):
+    # a partial build's chapters are numbered differently; keep them apart
+    return default_job_dir(url if select is None else "{} {}".format(url, select))
+
+
+def fetch_story(url, select=None, resume=False):
+    """
+    The story at url, and the positions of the chapters it leaves out because
+    an earlier run saved them (sites that can't select chapters leave none).
+    """
+    saved = []
+    if resume and get_site(url).selectable:
+        saved = Job(job_dir_for(url, select)).saved_chapters()
+    if saved:
+        return get_story(url, select=Unsaved(select, saved)), saved
+    return get_story(url, select=select), saved
+
+
+def selection_out_name(story, select):
+    # a partial book mustn't overwrite (or, with --update, replace) the whole one
+    spec = re.sub(r"[^\d-]+", "_", str(select))
+    return "{}-ch{}".format(story.default_out_name, spec)
+
+
+def build_story(
+    story,
+    url,
+    out_name=None,
+    move_to=None,
+    resume=False,
+    split=None,
+    update=False,
+    formats=("mobi",),
+    select=None,
+    skipped=(),
+    before_write=None,
+):
+    """
+    Renders story, checkpointing its pieces under .jobs/ until it's done;
+    skipped is as returned by fetch_story. Returns the paths written.
+
+    before_write, if given, is called once everything's fetched and before
+    any output is written; it can raise to stop the build there.
+    """
+    job_dir = job_dir_for(url, select)
+    if out_name is None and select is not None:
+        out_name = selection_out_name(story, select)
+    story = checkpointed(story, job_dir, resume=resume, skipped=skipped)
+    story = compile_story(story)
+    if before_write is not None:
+        before_write()
+    if split is None:
+        out = write_book(
+            story, formats, out_name=out_name, move_to=move_to, update=update
+        )
+    else:
+        out = build_volumes(
+            story,
+            out_name=out_name,
+            move_to=move_to,
+            split=split,
+            update=update,
+            formats=formats,
+        )
+    shutil.rmtree(job_dir)
+    return out
+
+
+def build(
+    url,
+    out_name=None,
+    move_to=None,
+    resume=False,
+    split=None,
+    update=False,
+    formats=("mobi",),
+    select=None,
+    before_write=None,
+):
+    story, skipped = fetch_story(url, select=select, resume=resume)
+    return build_story(
+        story,
+        url,
+        out_name=out_name,
+        move_to=move_to,
+        resume=resume,
+        split=split,
+        update=update,
+        formats=formats,
+        select=select,
+        skipped=skipped,
+        before_write=before_write,
+    )
+
+
+def build_works(
+    works,
+    move_to=None,
+    jobs=2,
+    resume=False,
+    split=None,
+    update=False,
+    formats=("mobi",),
+    before_write=None,
+):
+    """
+    Builds each work not already in move_to (the working dir without it);
+    with update, built works are brought up to date instead of skipped.
+    Works already in the HTTP cache go first, since they need no downloads.
+
+    Up to `jobs` stories are fetched ahead of the one being rendered; their
+    chapters all queue on the shared `helpers.futures` pool. A work that
+    fails is reported and the rest carry on, unless before_write raised.
+    """
+    from .transport import in_cache
+
+    def built(out_name):
+        if split is not None:
+            out_name = volume_name(out_name, 1)
+        return not update and already_built(out_name, move_to, formats)
+
+    aborted = []
+
+    def check():
+        # a before_write failure stops the whole run, not just this work
+        try:
+            before_write()
+        except BaseException as e:
+            aborted.append(e)
+            raise
+
+    todo = deque()
+    for work in works:
+        if built(work.out_name):
+            print("Skipping {} ({})".format(work.title, work.url), file=sys.stderr)
+        elif in_cache(work.url):
+            todo.appendleft(work)
+        else:
+            todo.append(work)
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        in_flight = deque()
+        while todo or in_flight:
+            while todo and len(in_flight) < jobs:
+                work = todo.popleft()
+                fut = pool.submit(fetch_story, work.url, resume=resume)
+                in_flight.append((work, fut))
+
+            work, fut = in_flight.popleft()
+            try:
+                story, skipped = fut.result()
+                # a listing's out_name is a guess; the story's own name is the
+                # one a build of its URL would use
+                if story.default_out_name != work.out_name and built(
+                    story.default_out_name
+                ):
+                    print(
+                        "Skipping {} ({})".format(work.title, work.url),
+                        file=sys.stderr,
+                    )
+                    # the site asked for its chapters as it was made
+                    for chap in story.chapters:
+                        for req in chap.pending:
+                            req.cancel()
+                    continue
+                build_story(
+                    story,
+                    work.url,
+                    move_to=move_to,
+                    resume=resume,
+                    split=split,
+                    update=update,
+                    formats=formats,
+                    skipped=skipped,
+                    before_write=check if before_write is not None else None,
+                )
+            except Exception as e:
+                if aborted:
+                    for _, queued in in_flight:
+                        queued.cancel()
+                    raise
+                print("ERROR on {}: {}".format(work.url, e), file=sys.stderr)
+                failed.append(work)
+            metrics.flush()
+    return failed
@@ -0,0 +1,271 @@
+import heapq
+import json
+import os
+import shutil
+import sys
+import threading
+
+from .helpers import hashify
+from .metrics import metrics
+from .sites.base import Chapter, Extra, Story
+
+
+def default_job_dir(url):
+    return os.path.join(".jobs", hashify(url))
+
+
+class SavedChapter(Chapter):
+    title = text = notes_pre = notes_post = extra = None
+
+    def __init__(self, **kwargs):
+        super(SavedChapter, self).__init__()
+        for k, v in kwargs.items():
+            setattr(self, k, v)
+
+    def __repr__(self):
+        return "SavedChapter({!r})".format(self.id)
+
+
+class SavedExtra(object):
+    """
+    An extra whose content is (or will be) stored in a job directory.
+    """
+
+    extra_attrs = Extra.extra_attrs
+
+    def __init__(self, job, url, id, name, attrs):
+        self.job = job
+        self.url = url
+        self.id = id
+        self.name = name
+        self.attrs = attrs
+
+    @property
+    def saved(self):
+        return os.path.exists(self.job.path("extras", self.name + ".json"))
+
+    @property
+    def mimetype(self):
+        with open(self.job.path("extras", self.name + ".json")) as f:
+            return json.load(f)["mimetype"]
+
+    @property
+    def content(self):
+        with open(self.job.path("extras", self.name), "rb") as f:
+            return f.read()
+
+    def __repr__(self):
+        return "SavedExtra({!r})".format(self.url)
+
+
+class SavedStory(Story):
+    chapters = extra = None
+
+    def __init__(self, story, chapters, extra):
+        self.story = story
+        self.chapters = chapters
+        self.extra = extra
+
+    id = property(lambda self: self.story.id)
+    title = property(lambda self: self.story.title)
+    author = property(lambda self: self.story.author)
+    publisher = property(lambda self: self.story.publisher)
+    default_out_name = property(lambda self: self.story.default_out_name)
+
+
+class Job(object):
+    """
+    A directory holding the extracted chapters and downloaded extras of one
+    build: chapters/NNNNN.json and extras/<name> plus extras/<name>.json.
+    """
+
+    def __init__(self, path):
+        self.dir = path
+        self._make_dirs()
+
+    def _make_dirs(self):
+        os.makedirs(self.path("chapters"), exist_ok=True)
+        os.makedirs(self.path("extras"), exist_ok=True)
+
+    def path(self, *parts):
+        return os.path.join(self.dir, *parts)
+
+    def clear(self):
+        shutil.rmtree(self.dir)
+        self._make_dirs()
+
+    def _write(self, path, data, mode="w"):
+        tmp = path + ".tmp"
+        with open(tmp, mode, encoding=None if "b" in mode else "utf-8") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def _saved_extras(self, metas):
+        return [SavedExtra(self, **meta) for meta in metas]
+
+    def saved_chapters(self):
+        """
+        The positions of the chapters saved so far.
+        """
+        return sorted(
+            int(name[: -len(".json")])
+            for name in os.listdir(self.path("chapters"))
+            if name.endswith(".json")
+        )
+
+    def load_chapter(self, i):
+        try:
+            path = self.path("chapters", "{:05}.json".format(i))
+            with open(path, encoding="utf-8") as f:
+                d = json.load(f)
+        except FileNotFoundError:
+            return None
+        d["notes_pre"] = [tuple(n) for n in d["notes_pre"]]
+        d["notes_post"] = [tuple(n) for n in d["notes_post"]]
+        d["extra"] = self._saved_extras(d["extra"])
+        return SavedChapter(**d)
+
+    def save_chapter(self, i, chap):
+        d = {
+            "id": str(chap.id),
+            "title": chap.title,
+            "text": chap.text,
+            "toc_extra": chap.toc_extra,
+            "notes_pre": [list(n) for n in chap.notes_pre],
+            "notes_post": [list(n) for n in chap.notes_post],
+            "extra": [
+                {"url": x.url, "id": x.id, "name": x.name, "attrs": x.attrs}
+                for x in chap.extra
+            ],
+        }
+        self._write(
+            self.path("chapters", "{:05}.json".format(i)),
+            json.dumps(d, ensure_ascii=False),
+        )
+        d["extra"] = self._saved_extras(d["extra"])
+        return SavedChapter(**d)
+
+    def save_extra(self, extra):
+        saved = SavedExtra(self, extra.url, extra.id, extra.name, extra.attrs)
+        if not saved.saved:
+            if isinstance(extra, SavedExtra):  # failed last time; fetch it again
+                extra = Extra(extra.url)
+            self._write(self.path("extras", saved.name), extra.content, "wb")
+            meta = {"url": extra.url, "mimetype": extra.mimetype}
+            self._write(self.path("extras", saved.name + ".json"), json.dumps(meta))
+        return saved
+
+
+def in_arrival_order(items):
+    """
+    Yields the (i, chapter) pairs in items as each chapter's downloads finish,
+    taking the earliest in TOC order of those ready. Chapters are parsed
+    while later ones are still downloading, rather than all waiting on
+    whichever comes first in the book.
+    """
+    ready = []
+    cond = threading.Condition()
+
+    def arrived(n):
+        with cond:
+            heapq.heappush(ready, n)
+            cond.notify()
+
+    for n, (i, chap) in enumerate(items):
+        pending = list(chap.pending)
+        if not pending:
+            arrived(n)
+            continue
+
+        left = [len(pending)]
+
+        def done(_, n=n, left=left):
+            with cond:
+                left[0] -= 1
+                if left[0] == 0:
+                    arrived(n)
+
+        for fut in pending:
+            fut.add_done_callback(done)
+
+    for _ in items:
+        with cond:
+            while not ready:
+                cond.wait()
+            n = heapq.heappop(ready)
+        yield items[n]
+
+
+class Unsaved(object):
+    """
+    A chapter selection, for a site's select=, of the chapters a job hasn't
+    saved yet out of those `select` picks (all of them without it), so that
+    a resumed build doesn't request the rest again.
+    """
+
+    def __init__(self, select, saved):
+        self.select = select
+        self.saved = set(saved)
+
+    def __str__(self):
+        return str(self.select)
+
+    def pick(self, items):
+        if self.select is not None:
+            items = self.select.pick(items)
+        return [x for i, x in enumerate(items) if i not in self.saved]
+
+
+def checkpointed(story, job_dir, resume=False, skipped=()):
+    """
+    Extracts each chapter and downloads each extra of story into job_dir,
+    returning a story that reads them back from there. With resume, pieces
+    already saved by an earlier run are reused rather than refetched;
+    skipped are the positions of saved chapters that story left out (it was
+    made with an Unsaved selection).
+
+    Failures are collected rather than stopping at the first one; if any
+    happen, an IOError is raised once everything else has been saved.
+    """
+    job = Job(job_dir)
+    if not resume:
+        job.clear()
+        skipped = ()
+
+    failed = []
+    skipped = set(skipped)
+    n = len(story.chapters) + len(skipped)
+    positions = [i for i in range(n) if i not in skipped][: len(story.chapters)]
+    chapters = [job.load_chapter(i) for i in range(n)]
+    todo = [
+        (i, chap)
+        for i, chap in zip(positions, story.chapters)
+        if chapters[i] is None
+    ]
+    for i, chap in in_arrival_order(todo):
+        try:
+            chapters[i] = job.save_chapter(i, chap)
+            metrics.count("chapters_total")
+        except Exception as e:
+            failed.append((chap, e))
+    chapters = [c for c in chapters if c is not None]
+
+    extra = []
+    if not failed:
+        # some stories build their extras from their chapters' extras
+        story.chapters = chapters
+        for x in story.extra:
+            try:
+                extra.append(job.save_extra(x))
+            except Exception as e:
+                failed.append((x, e))
+
+    if failed:
+        for thing, e in failed:
+            print("ERROR on {!r}: {}".format(thing, e), file=sys.stderr)
+        raise IOError(
+            "{} pieces failed; run again with --resume to retry them "
+            "(saved in {})".format(len(failed), job_dir)
+        )
+
+    return SavedStory(story, chapters, extra)
@@ -1,7 +1,16 @@
 import os
+import sys
 
-from .formats import make_mobi
-from .sites import get_story
+import argparse
+
+from . import helpers
+from .batch import build, build_works
+from .config import read_config
+from .formats import writers
+from .metrics import metrics
+from .sites import ChapterSelection, get_works
+from .volumes import VolumeSpec
+from .watch import Watched, Watcher, read_watchlist
 
 
 def default_move_to():
@@ -12,17 +21,469 @@ def default_move_to():
     return None
 
 
-def main():
-    import argparse
+def add_transport_args(parser, argv):
+    """
+    Adds the network options, defaulting to the values in the config file.
+    """
+    pre = argparse.ArgumentParser(add_help=False)
+    pre.add_argument("--config")
+    known, _ = pre.parse_known_args(argv)
+
+    g = parser.add_argument_group("network")
+    g.add_argument(
+        "--config",
+        help="settings file (default ~/.config/make-ebook.ini, ./make-ebook.ini)",
+    )
+    g.add_argument(
+        "--delay",
+        type=float,
+        help="seconds between requests to the same host "
+        "(default 0, or 0.5 for author pages)",
+    )
+    g.add_argument("--workers", type=int, help="concurrent downloads (default 5)")
+    g.add_argument(
+        "--per-host",
+        type=int,
+        metavar="N",
+        help="at most N downloads at once from any one host (default no limit)",
+    )
+    g.add_argument(
+        "--pool-size", type=int, help="connections kept open per host (default 10)"
+    )
+    g.add_argument(
+        "--preconnect",
+        action="store_true",
+        help="connect to the story's host while everything else starts up",
+    )
+    g.add_argument(
+        "--stats", action="store_true", help="print connection reuse when done"
+    )
+    g.add_argument(
+        "--offline",
+        action="store_true",
+        help="answer every request from the cache, failing on anything missing",
+    )
+    g.add_argument(
+        "--metrics",
+        metavar="PATH",
+        help="write run metrics here: JSON if it ends in .json, "
+        "else a Prometheus textfile",
+    )
+    parser.set_defaults(**read_config(known.config))
+
+
+def apply_transport_args(args):
+    helpers.configure(
+        **{
+            k: getattr(args, k)
+            for k in ["workers", "pool_size", "pool_hosts"]
+            if getattr(args, k, None) is not None
+        }
+    )
+    helpers.throttle.delay = args.delay or 0
+    helpers.throttle.per_host = args.per_host
+    helpers.offline.enabled = args.offline
+    metrics.path = args.metrics
+
+
+def report(args):
+    metrics.flush()
+    if args.offline and helpers.offline.misses:
+        helpers.offline.report()
+    if args.stats:
+        print_stats()
+
+
+def print_stats():
+    from .transport import print_stats
+
+    print_stats()
+
+
+def serve_main(argv):
+    from .daemon import serve
+
+    parser = argparse.ArgumentParser(
+        prog="make-ebook.py serve", description="Accept build jobs over HTTP."
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument(
+        "--jobs", "-j", type=int, default=2, help="builds to run at once (default 2)"
+    )
+    parser.add_argument("--move-to", "-m", default=default_move_to())
+    add_transport_args(parser, argv)
+    args = parser.parse_args(argv)
+
+    apply_transport_args(args)
+    try:
+        serve(host=args.host, port=args.port, jobs=args.jobs, move_to=args.move_to)
+    finally:
+        report(args)
+
+
+def watch_main(argv):
+    parser = argparse.ArgumentParser(
+        prog="make-ebook watch",
+        description="Poll stories for new chapters and rebuild those that change.",
+    )
+    parser.add_argument(
+        "watchlist", help="a file with a story URL (and optional out_name) per line"
+    )
+    parser.add_argument(
+        "--interval",
+        type=parse_duration,
+        default=3600,
+        help="how often to poll each story, e.g. 30m or 2h (default 1h)",
+    )
+    parser.add_argument(
+        "--host-budget",
+        type=float,
+        default=6,
+        metavar="N",
+        help="at most N polls per minute to any one host (default 6)",
+    )
+    parser.add_argument(
+        "--state",
+        default=".watch.json",
+        help="where to keep what each story looked like (default .watch.json)",
+    )
+    parser.add_argument(
+        "--once", action="store_true", help="poll everything once, then exit"
+    )
+    parser.add_argument(
+        "--jobs", "-j", type=int, default=2, help="builds to run at once (default 2)"
+    )
+    parser.add_argument("--move-to", "-m", default=default_move_to())
+    add_output_args(parser)
+    add_volume_args(parser)
+    add_transport_args(parser, argv)
+    args = parser.parse_args(argv)
+
+    apply_transport_args(args)
+    helpers.char_refs = args.ascii
+    if args.delay is None:
+        helpers.throttle.delay = 0.5
+    watcher = Watcher(
+        read_watchlist(args.watchlist),
+        state_path=args.state,
+        interval=args.interval,
+        host_budget=args.host_budget,
+        jobs=args.jobs,
+        move_to=args.move_to,
+        split=volume_spec(args),
+        formats=args.formats,
+    )
+    try:
+        watcher.run(once=args.once)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        report(args)
+
+
+def prefetch_main(argv):
+    from .prefetch import prefetch
+
+    parser = argparse.ArgumentParser(
+        prog="make-ebook prefetch",
+        description="Download stories into the HTTP cache without building them.",
+    )
+    parser.add_argument("urls", nargs="*", help="stories or author pages")
+    parser.add_argument(
+        "--list",
+        metavar="FILE",
+        help="also read URLs from FILE, in the same format as a watchlist",
+    )
+    parser.add_argument(
+        "--jobs", "-j", type=int, default=2, help="stories to fetch at once (default 2)"
+    )
+    parser.add_argument(
+        "--no-extras",
+        dest="extras",
+        action="store_false",
+        help="skip images, which are only found by parsing the chapters",
+    )
+    add_transport_args(parser, argv)
+    args = parser.parse_args(argv)
+
+    urls = list(args.urls)
+    if args.list:
+        urls += [w.url for w in read_watchlist(args.list)]
+    if not urls:
+        parser.error("nothing to prefetch")
+
+    apply_transport_args(args)
+    # stay out of the way of builds running alongside
+    if args.delay is None:
+        helpers.throttle.delay = 0.5
+    if args.per_host is None:
+        helpers.throttle.per_host = 2
+    if hasattr(os, "nice"):
+        os.nice(10)
+    try:
+        failed = prefetch(urls, jobs=args.jobs, extras=args.extras)
+    finally:
+        report(args)
+    if failed:
+        sys.exit(1)
+
+
+def worker_main(argv):
+    from .worker import JobQueue, queue_path, work
+
+    parser = argparse.ArgumentParser(
+        prog="make-ebook worker",
+        description="Build jobs queued in a directory shared with other workers.",
+    )
+    parser.add_argument("dir", help="the shared directory holding queue.sqlite")
+    parser.add_argument(
+        "--jobs", "-j", type=int, default=1, help="builds to run at once (default 1)"
+    )
+    parser.add_argument(
+        "--lease",
+        type=parse_duration,
+        default=300,
+        help="how long a claimed job is ours without a heartbeat (default 5m)",
+    )
+    parser.add_argument(
+        "--poll",
+        type=parse_duration,
+        default=10,
+        help="how long to wait when the queue is empty (default 10s)",
+    )
+    parser.add_argument(
+        "--drain", action="store_true", help="exit once the queue is empty"
+    )
+    parser.add_argument(
+        "--move-to", "-m", help="where to put the books (default the shared dir)"
+    )
+    add_transport_args(parser, argv)
+    args = parser.parse_args(argv)
+
+    apply_transport_args(args)
+    queue = JobQueue(queue_path(args.dir))
+    # every worker spaces out its requests to a host through the queue
+    helpers.throttle.shared = queue
+    if args.delay is None:
+        helpers.throttle.delay = 0.5
+    try:
+        work(
+            queue,
+            move_to=args.move_to or args.dir,
+            jobs=args.jobs,
+            lease=args.lease,
+            poll=args.poll,
+            drain=args.drain,
+        )
+    except KeyboardInterrupt:
+        pass
+    finally:
+        report(args)
+
+
+def enqueue_main(argv):
+    from .worker import JobQueue, queue_path
 
-    parser = argparse.ArgumentParser()
-    parser.add_argument("url")
+    parser = argparse.ArgumentParser(
+        prog="make-ebook enqueue", description="Queue builds for workers."
+    )
+    parser.add_argument("dir", help="the shared directory holding queue.sqlite")
+    parser.add_argument("urls", nargs="*", help="stories or author pages")
+    parser.add_argument(
+        "--list",
+        metavar="FILE",
+        help="also queue the stories in FILE, in the same format as a watchlist",
+    )
+    args = parser.parse_args(argv)
+
+    queue = JobQueue(queue_path(args.dir))
+    watched = [Watched(url, None) for url in args.urls]
+    if args.list:
+        watched += read_watchlist(args.list)
+    for w in watched:
+        queue.submit(w.url, w.out_name)
+    counts = queue.counts()
+    print(", ".join("{} {}".format(n, k) for k, n in sorted(counts.items())))
+
+
+commands = {
+    "serve": serve_main,
+    "watch": watch_main,
+    "prefetch": prefetch_main,
+    "worker": worker_main,
+    "enqueue": enqueue_main,
+}
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv and argv[0] in commands:
+        return commands[argv[0]](argv[1:])
+
+    parser = argparse.ArgumentParser(
+        epilog="Other commands: {}; see <command> --help.".format(
+            ", ".join(sorted(commands))
+        )
+    )
+    parser.add_argument("url", help="a story, or an author page to build every work")
     parser.add_argument("out_name", nargs="?")
 
     g = parser.add_mutually_exclusive_group()
     g.add_argument("--move-to", "-m", default=default_move_to())
     g.add_argument("--no-move", dest="move_to", action="store_const", const=None)
-    args = parser.parse_args()
 
-    story = get_story(args.url)
-    make_mobi(story, out_name=args.out_name, move_to=args.move_to)
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=2,
+        help="for author pages, how many works to fetch ahead (default 2)",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="reuse the chapters and extras saved by an earlier failed run",
+    )
+    parser.add_argument(
+        "--chapters",
+        type=parse_chapters,
+        metavar="RANGES",
+        help="only build these chapters, by position, e.g. 500-550 or 1-3,10-; "
+        "written to NAME-chRANGES unless out_name is given",
+    )
+    add_output_args(parser)
+
+    g = add_volume_args(parser)
+    g.add_argument(
+        "--update",
+        action="store_true",
+        help="bring existing books up to date: with volumes, rebuild only from "
+        "the last one already built; EPUBs get new chapters appended in place",
+    )
+    add_transport_args(parser, argv)
+    args = parser.parse_args(argv)
+
+    apply_transport_args(args)
+    helpers.char_refs = args.ascii
+    if args.preconnect and not args.offline:
+        helpers.preconnect(args.url)
+    try:
+        run(parser, args)
+    finally:
+        report(args)
+
+
+def add_output_args(parser):
+    parser.add_argument(
+        "--format",
+        "-f",
+        dest="formats",
+        type=parse_formats,
+        default=["mobi"],
+        metavar="FORMATS",
+        help="output formats, comma-separated, from {} (default mobi)".format(
+            ", ".join(sorted(writers))
+        ),
+    )
+    parser.add_argument(
+        "--ascii",
+        action="store_true",
+        help="write non-ASCII text as &#NNNN; character references, not UTF-8",
+    )
+
+
+def add_volume_args(parser):
+    g = parser.add_argument_group("volumes")
+    g.add_argument(
+        "--volume-chapters",
+        type=int,
+        metavar="N",
+        help="split into volumes of at most N chapters",
+    )
+    g.add_argument(
+        "--volume-size",
+        type=parse_size,
+        metavar="SIZE",
+        help="split into volumes of about SIZE of text (e.g. 2M)",
+    )
+    return g
+
+
+def volume_spec(args):
+    if args.volume_chapters or args.volume_size:
+        return VolumeSpec(args.volume_chapters, args.volume_size)
+    return None
+
+
+def parse_formats(s):
+    formats = [f.strip().lower() for f in s.split(",") if f.strip()]
+    unknown = [f for f in formats if f not in writers]
+    if unknown or not formats:
+        raise argparse.ArgumentTypeError("invalid format: {!r}".format(s))
+    # keep the order given, without repeats
+    return list(dict.fromkeys(formats))
+
+
+def parse_chapters(s):
+    try:
+        return ChapterSelection(s)
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid chapter ranges: {!r}".format(s))
+
+
+def parse_duration(s):
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+    try:
+        if s[-1:].lower() in units:
+            return float(s[:-1]) * units[s[-1].lower()]
+        return float(s)
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid duration: {!r}".format(s))
+
+
+def parse_size(s):
+    units = {"k": 2**10, "m": 2**20, "g": 2**30}
+    try:
+        if s[-1:].lower() in units:
+            return int(float(s[:-1]) * units[s[-1].lower()])
+        return int(s)
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid size: {!r}".format(s))
+
+
+def run(parser, args):
+    split = volume_spec(args)
+
+    works = get_works(args.url)
+    if works is None:
+        build(
+            args.url,
+            out_name=args.out_name,
+            move_to=args.move_to,
+            resume=args.resume,
+            split=split,
+            update=args.update,
+            formats=args.formats,
+            select=args.chapters,
+        )
+        return
+
+    if args.out_name is not None:
+        parser.error("out_name can't be used with an author page")
+    if args.chapters is not None:
+        parser.error("--chapters can't be used with an author page")
+    if args.delay is None:
+        helpers.throttle.delay = 0.5
+    failed = build_works(
+        works,
+        move_to=args.move_to,
+        jobs=args.jobs,
+        resume=args.resume,
+        split=split,
+        update=args.update,
+        formats=args.formats,
+    )
+    if failed:
+        sys.exit(1)
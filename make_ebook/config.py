@@ -0,0 +1,44 @@
+import configparser
+import os
+
+default_paths = [os.path.expanduser("~/.config/make-ebook.ini"), "make-ebook.ini"]
+
+# key in the [transport] section -> ConfigParser getter
+transport_keys = {
+    "workers": "getint",
+    "pool_size": "getint",
+    "pool_hosts": "getint",
+    "delay": "getfloat",
+    "per_host": "getint",
+    "preconnect": "getboolean",
+    "stats": "getboolean",
+    "offline": "getboolean",
+    "metrics": "get",
+}
+
+
+def read_config(path=None):
+    """
+    The [transport] settings from path, or else from default_paths, e.g.
+
+        [transport]
+        workers = 8
+        pool_size = 8
+        delay = 0.5
+        preconnect = yes
+    """
+    parser = configparser.ConfigParser()
+    if path is None:
+        parser.read(default_paths)
+    else:
+        with open(path) as f:
+            parser.read_file(f)
+
+    if not parser.has_section("transport"):
+        return {}
+    section = parser["transport"]
+    return {
+        key: getattr(section, getter)(key)
+        for key, getter in transport_keys.items()
+        if key in section
+    }
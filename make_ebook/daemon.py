@@ -0,0 +1,188 @@
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import itertools
+import json
+import sys
+import threading
+import time
+
+from . import helpers
+from .batch import build, build_works
+from .metrics import metrics
+from .sites import get_works, load_all
+
+
+class Job(object):
+    _ids = itertools.count(1)
+
+    def __init__(self, url, out_name=None, move_to=None):
+        self.id = next(Job._ids)
+        self.url = url
+        self.out_name = out_name
+        self.move_to = move_to
+        # called just before any output is written; raising stops the build
+        self.before_write = None
+
+        self.status = "queued"
+        self.result = self.error = None
+        self.submitted = time.time()
+        self.started = self.finished = None
+
+    def run(self):
+        self.status = "running"
+        self.started = time.time()
+        try:
+            works = get_works(self.url)
+            if works is None:
+                self.result = build(
+                    self.url,
+                    out_name=self.out_name,
+                    move_to=self.move_to,
+                    before_write=self.before_write,
+                )
+            else:
+                failed = build_works(
+                    works, move_to=self.move_to, before_write=self.before_write
+                )
+                self.result = {"failed": [w.url for w in failed]}
+            self.status = "done"
+        # a broken job shouldn't take us down
+        except (Exception, SystemExit) as e:
+            self.error = "{}: {}".format(type(e).__name__, e)
+            self.status = "failed"
+        finally:
+            self.finished = time.time()
+            metrics.flush()
+
+    def as_dict(self):
+        return {
+            k: getattr(self, k)
+            for k in [
+                "id",
+                "url",
+                "out_name",
+                "move_to",
+                "status",
+                "result",
+                "error",
+                "submitted",
+                "started",
+                "finished",
+            ]
+        }
+
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    GET /jobs, GET /jobs/<id>, POST /jobs with {"url": ..., "out_name": ...,
+    "move_to": ...}.
+    """
+
+    def send_json(self, code, obj):
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        parts = self.path.strip("/").split("/")
+        if parts == ["jobs"]:
+            self.send_json(200, self.server.status())
+        elif len(parts) == 2 and parts[0] == "jobs" and parts[1].isdigit():
+            job = self.server.jobs.get(int(parts[1]))
+            if job is None:
+                self.send_json(404, {"error": "no such job"})
+            else:
+                self.send_json(200, job.as_dict())
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path.strip("/") != "jobs":
+            self.send_json(404, {"error": "not found"})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            args = json.loads(self.rfile.read(length))
+            url = args["url"]
+        except (ValueError, KeyError, TypeError):
+            self.send_json(400, {"error": "expected a JSON object with a url"})
+            return
+
+        job = self.server.submit(
+            url,
+            out_name=args.get("out_name"),
+            move_to=args.get("move_to", self.server.move_to),
+        )
+        self.send_json(202, job.as_dict())
+
+
+class Server(ThreadingHTTPServer):
+    """
+    Runs build jobs in this process, so the HTTP session, connection pools
+    and in-memory caches stay warm between them. At most `jobs` builds run at
+    once; their requests all share the one `helpers.futures` pool.
+
+    Only the latest `keep` finished jobs are remembered.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, jobs=2, move_to=None, keep=100):
+        super(Server, self).__init__(address, Handler)
+        self.move_to = move_to
+        self.keep = keep
+        self.pool = ThreadPoolExecutor(max_workers=jobs)
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def submit(self, url, out_name=None, move_to=None):
+        """
+        Queues a build of url, unless one is already queued or running (they
+        would share a checkpoint directory); returns the job.
+        """
+        with self.lock:
+            for job in self.jobs.values():
+                if job.url == url and job.status in {"queued", "running"}:
+                    return job
+            job = Job(url, out_name=out_name, move_to=move_to)
+            self.jobs[job.id] = job
+            self._prune()
+        self.pool.submit(job.run)
+        return job
+
+    def _prune(self):
+        done = [
+            job.id
+            for job in self.jobs.values()
+            if job.status not in {"queued", "running"}
+        ]
+        for id in done[: max(0, len(done) - self.keep)]:
+            del self.jobs[id]
+
+    def status(self):
+        with self.lock:
+            jobs = [job.as_dict() for job in self.jobs.values()]
+        counts = {}
+        for job in jobs:
+            counts[job["status"]] = counts.get(job["status"], 0) + 1
+        return {"counts": counts, "jobs": jobs}
+
+
+def serve(host="127.0.0.1", port=8080, jobs=2, move_to=None):
+    load_all()
+    helpers.futures  # build the network stack up front
+
+    server = Server((host, port), jobs=jobs, move_to=move_to)
+    print("Listening on http://{}:{}/jobs".format(*server.server_address[:2]))
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.pool.shutdown(wait=False)
@@ -1 +1,7 @@
+from .epub import make_epub
+from .html import make_html
 from .mobi import make_mobi
+
+
+# each takes (story, out_name=None, move_to=None, pool=None, update=False)
+writers = {"mobi": make_mobi, "epub": make_epub, "html": make_html}
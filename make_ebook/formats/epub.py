@@ -0,0 +1,357 @@
+"""
+EPUB 3 output, one XHTML document per chapter.
+
+Entries are written in a fixed order: the static files, the chapters and
+extras, then the documents that list them (notes, nav, NCX, OPF) last. An
+update can then keep everything up to the first of those, append the new
+chapters and extras, and write a fresh tail, without touching or
+recompressing the rest of the archive.
+"""
+
+import os
+import re
+import shutil
+import time
+import zipfile
+import zlib
+
+from ..helpers import hashify
+from ..metrics import metrics
+from ..model import compile_story
+
+
+container_xml = """<?xml version="1.0" encoding="utf-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+    <rootfiles>
+        <rootfile full-path="OEBPS/content.opf"
+                  media-type="application/oebps-package+xml"/>
+    </rootfiles>
+</container>
+"""
+
+style_css = """
+h1, h2 { text-align: center; }
+.notelink { text-align: center; font-size: 70%; margin: 2ex; }
+"""
+
+xhtml_head = r"""<?xml version="1.0" encoding="utf-8"?>
+<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml"
+      xmlns:epub="http://www.idpf.org/2007/ops" lang="en" xml:lang="en">
+<head>
+    <meta charset="utf-8" />
+    <title>{{ title|xml }}</title>
+    <link rel="stylesheet" type="text/css" href="style.css" />
+</head>
+"""
+
+chapter_format = (
+    xhtml_head
+    + r"""
+<body>
+<section epub:type="chapter">
+    <h1>{{ chap.title|xml }}</h1>
+    {% for ref in pre %}
+        <div class="notelink">
+            <a id="{{ ref.source }}" href="notes.xhtml#{{ ref.key }}"
+               epub:type="noteref">{{ ref.name|xml }}</a>
+        </div>
+    {% endfor %}
+
+    {{ chap.text }}
+
+    {% for ref in post %}
+        <div class="notelink">
+            <a id="{{ ref.source }}" href="notes.xhtml#{{ ref.key }}"
+               epub:type="noteref">{{ ref.name|xml }}</a>
+        </div>
+    {% endfor %}
+</section>
+</body>
+</html>
+"""
+)
+
+notes_format = (
+    xhtml_head
+    + r"""
+<body>
+<section epub:type="endnotes">
+    <h1>Notes</h1>
+    {% for note in story.notes %}
+        <aside id="{{ note.key }}" epub:type="endnote">
+            <a href="{{ note.chapter|doc }}#{{ note.source }}"
+                >{{ note.chapter.title|xml }}: {{ note.name|xml }}</a>
+            {{ note.text }}
+        </aside>
+        <hr/>
+    {% endfor %}
+</section>
+</body>
+</html>
+"""
+)
+
+nav_format = (
+    xhtml_head
+    + r"""
+<body>
+<nav epub:type="toc" id="toc">
+    <h1>Table of Contents</h1>
+    <ol>
+        {% for chap in story.chapters %}
+            <li><a href="{{ chap|doc }}">{{ chap.title|xml }}</a></li>
+        {% endfor %}
+        {% if story.notes %}
+            <li><a href="notes.xhtml">Notes</a></li>
+        {% endif %}
+    </ol>
+</nav>
+<nav epub:type="landmarks" hidden="">
+    <ol>
+        <li><a epub:type="toc" href="nav.xhtml#toc">Table of Contents</a></li>
+        {% if story.chapters %}
+            <li><a epub:type="bodymatter" href="{{ story.chapters[0]|doc }}"
+                >Book</a></li>
+        {% endif %}
+    </ol>
+</nav>
+</body>
+</html>
+"""
+)
+
+toc_format = r"""<?xml version="1.0" encoding="utf-8"?>
+<ncx xmlns="http://www.daisy.org/z3986/2005/ncx/" version="2005-1">
+    <head>
+        <meta name="dtb:uid" content="{{ uid }}" />
+    </head>
+    <docTitle><text>{{ story.title|xml }}</text></docTitle>
+    <navMap>
+        {% for chap in story.chapters %}
+        <navPoint id="nav-{{ chap|doc_id }}" playOrder="{{ loop.index }}">
+            <navLabel><text>{{ chap.title|xml }}</text></navLabel>
+            <content src="{{ chap|doc }}" />
+        </navPoint>
+        {% endfor %}
+        {% if story.notes %}
+        <navPoint id="nav-notes" playOrder="{{ story.chapters|length + 1 }}">
+            <navLabel><text>Notes</text></navLabel>
+            <content src="notes.xhtml" />
+        </navPoint>
+        {% endif %}
+    </navMap>
+</ncx>
+"""
+
+opf_format = r"""<?xml version="1.0" encoding="utf-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="3.0"
+         unique-identifier="uid" xml:lang="en">
+    <metadata xmlns:dc="http://purl.org/dc/elements/1.1/">
+        <dc:identifier id="uid">{{ uid }}</dc:identifier>
+        <dc:title>{{ story.title|xml }}</dc:title>
+        <dc:creator>{{ story.author|xml }}</dc:creator>
+        <dc:publisher>Published on {{ story.publisher|xml }}</dc:publisher>
+        <dc:language>en</dc:language>
+        <meta property="dcterms:modified">{{ modified }}</meta>
+        {% for x in story.extra if x.is_cover %}
+            <meta name="cover" content="{{ x.id }}" />
+        {% endfor %}
+    </metadata>
+    <manifest>
+        <item id="nav" href="nav.xhtml" media-type="application/xhtml+xml"
+              properties="nav" />
+        <item id="ncx" href="toc.ncx" media-type="application/x-dtbncx+xml" />
+        <item id="style" href="style.css" media-type="text/css" />
+        {% for chap in story.chapters %}
+            <item id="{{ chap|doc_id }}" href="{{ chap|doc }}"
+                  media-type="application/xhtml+xml" />
+        {% endfor %}
+        {% if story.notes %}
+            <item id="notes" href="notes.xhtml"
+                  media-type="application/xhtml+xml" />
+        {% endif %}
+        {% for extra in story.extra %}
+            <item id="{{ extra.id }}" href="{{ extra.name }}"
+                  media-type="{{ extra.mimetype }}" {{ extra.extra_attrs }} />
+        {% endfor %}
+    </manifest>
+    <spine toc="ncx">
+        <itemref idref="nav" />
+        {% for chap in story.chapters %}
+            <itemref idref="{{ chap|doc_id }}" />
+        {% endfor %}
+        {% if story.notes %}
+            <itemref idref="notes" />
+        {% endif %}
+    </spine>
+</package>
+"""
+
+# bare ampersands and angle brackets, leaving character references alone
+_xml_re = re.compile(r"&(?!#?\w+;)|<|>")
+_xml_escapes = {"&": "&amp;", "<": "&lt;", ">": "&gt;"}
+
+
+def xml_text(s):
+    return _xml_re.sub(lambda m: _xml_escapes[m.group(0)], str(s))
+
+
+def doc_id(chap):
+    return "chap-{}".format(hashify(chap.id)[:16])
+
+
+def doc_name(chap):
+    return doc_id(chap) + ".xhtml"
+
+
+def _env():
+    import jinja2
+
+    env = jinja2.Environment(undefined=jinja2.StrictUndefined)
+    env.filters.update(xml=xml_text, doc=doc_name, doc_id=doc_id)
+    return env
+
+
+def _info(name, compress=True):
+    info = zipfile.ZipInfo(name, time.gmtime()[:6])
+    info.compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+    return info
+
+
+def head_parts():
+    return [
+        ("mimetype", b"application/epub+zip"),
+        ("META-INF/container.xml", container_xml.encode("utf-8")),
+        ("OEBPS/style.css", style_css.encode("utf-8")),
+    ]
+
+
+def chapter_parts(story, env):
+    template = env.from_string(chapter_format)
+    parts = []
+    for chap in story.chapters:
+        pre, post = story.note_refs[chap.id]
+        html = template.render(title=chap.title, chap=chap, pre=pre, post=post)
+        parts.append(("OEBPS/" + doc_name(chap), html.encode("utf-8")))
+    return parts
+
+
+def tail_parts(story, env):
+    d = {
+        "story": story,
+        "title": story.title,
+        "uid": "urn:make-ebook:{}".format(story.id),
+        "modified": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+    names = [("OEBPS/nav.xhtml", nav_format), ("OEBPS/toc.ncx", toc_format)]
+    if story.notes:
+        names.insert(0, ("OEBPS/notes.xhtml", notes_format))
+    names.append(("OEBPS/content.opf", opf_format))
+    return [
+        (name, env.from_string(template).render(**d).encode("utf-8"))
+        for name, template in names
+    ]
+
+
+# every name the tail might use, whether or not this build has notes
+tail_names = {"OEBPS/notes.xhtml", "OEBPS/nav.xhtml", "OEBPS/toc.ncx"}
+tail_names.add("OEBPS/content.opf")
+
+
+def _write_parts(zf, parts, extra):
+    for name, data in parts:
+        zf.writestr(_info(name, name != "mimetype"), data)
+    for x in extra:
+        # images are already compressed
+        compress = not x.mimetype.startswith("image/")
+        zf.writestr(_info("OEBPS/" + x.name, compress), x.content)
+
+
+def write_epub(path, head, chapters, extra, tail):
+    tmp = path + ".tmp"
+    with zipfile.ZipFile(tmp, "w") as zf:
+        _write_parts(zf, head + chapters, extra)
+        _write_parts(zf, tail, [])
+    os.replace(tmp, path)
+
+
+def append_epub(path, head, chapters, extra, tail):
+    """
+    Brings the EPUB at path up to date by appending whatever chapters and
+    extras it's missing, if everything it already has is unchanged; returns
+    False (having changed nothing) if it needs a full rebuild instead.
+    """
+    with zipfile.ZipFile(path) as zf:
+        infos = zf.infolist()
+    cut = next(
+        (i for i, info in enumerate(infos) if info.filename in tail_names),
+        len(infos),
+    )
+    if any(info.filename not in tail_names for info in infos[cut:]):
+        return False
+    old = {info.filename: info for info in infos[:cut]}
+
+    docs = head + chapters
+    extra_names = {"OEBPS/" + x.name for x in extra}
+    if set(old) - {name for name, _ in docs} - extra_names:
+        return False  # something was removed
+    for name, data in docs:
+        info = old.get(name)
+        if info is not None and (
+            info.file_size != len(data) or info.CRC != zlib.crc32(data)
+        ):
+            return False  # something changed
+
+    new_docs = [(name, data) for name, data in docs if name not in old]
+    new_extra = [x for x in extra if "OEBPS/" + x.name not in old]
+
+    # on a copy, so the book is whole until the new one replaces it; the
+    # copy is just bytes, nothing gets recompressed
+    tmp = path + ".tmp"
+    shutil.copyfile(path, tmp)
+    try:
+        with zipfile.ZipFile(tmp, "a") as zf:
+            # drop the old tail; writes start where it did, and closing
+            # truncates whatever is left of it after the new central directory
+            end = infos[cut].header_offset if cut < len(infos) else zf.start_dir
+            zf.filelist = [i for i in zf.filelist if i.header_offset < end]
+            zf.NameToInfo = {info.filename: info for info in zf.filelist}
+            zf.start_dir = end
+            _write_parts(zf, new_docs, new_extra)
+            _write_parts(zf, tail, [])
+    except BaseException:
+        os.remove(tmp)
+        raise
+    os.replace(tmp, path)
+    return True
+
+
+def make_epub(story, out_name=None, move_to=None, pool=None, update=False):
+    """
+    Writes story as an EPUB. With update, an existing file is brought up to
+    date by appending new chapters when that's possible.
+    """
+    story = compile_story(story)
+    if out_name is None:
+        out_name = story.default_out_name
+
+    env = _env()
+    with metrics.timer("write_seconds_total", stage="render"):
+        head = head_parts()
+        chapters = chapter_parts(story, env)
+        tail = tail_parts(story, env)
+
+    out_path = "{}.epub".format(out_name)
+    if move_to is not None:
+        out_path = os.path.join(move_to, out_path)
+    with metrics.timer("write_seconds_total", stage="epub"):
+        if not (
+            update
+            and os.path.exists(out_path)
+            and append_epub(out_path, head, chapters, story.extra, tail)
+        ):
+            write_epub(out_path, head, chapters, story.extra, tail)
+    if move_to is not None:
+        print("Output in {}".format(out_path))
+    return out_path
@@ -0,0 +1,48 @@
+from base64 import b64encode
+import os
+import re
+
+from ..metrics import metrics
+from ..model import compile_story
+from .mobi import book_format
+
+
+src_re = re.compile(r'src="([^"]*)"')
+
+
+def data_uri(extra):
+    return "data:{};base64,{}".format(
+        extra.mimetype, b64encode(extra.content).decode("ascii")
+    )
+
+
+def make_html(story, out_name=None, move_to=None, pool=None, update=False):
+    """
+    Writes story as a single standalone HTML file, with its images inlined.
+    """
+    import jinja2
+
+    story = compile_story(story)
+    if out_name is None:
+        out_name = story.default_out_name
+
+    env = jinja2.Environment(undefined=jinja2.StrictUndefined)
+    with metrics.timer("write_seconds_total", stage="render"):
+        html = env.from_string(book_format).render(story=story)
+        extras = {x.name: x for x in story.extra}
+
+        def inline(m):
+            x = extras.get(m.group(1))
+            return m.group(0) if x is None else 'src="{}"'.format(data_uri(x))
+
+        html = src_re.sub(inline, html)
+
+    out_path = "{}.html".format(out_name)
+    if move_to is not None:
+        out_path = os.path.join(move_to, out_path)
+    with metrics.timer("write_seconds_total", stage="html"):
+        with open(out_path, "w", encoding="utf-8") as f:
+            f.write(html)
+    if move_to is not None:
+        print("Output in {}".format(out_path))
+    return out_path
@@ -0,0 +1,244 @@
+"""
+Writes MOBI (Mobipocket 6) files directly, without kindlegen.
+
+The book is one HTML flow: internal links become filepos= byte offsets,
+images become recindex= references to image records, and the text is split
+into 4096-byte PalmDoc-compressed records, compressed in parallel.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import re
+import struct
+import time
+import zlib
+
+from .palmdoc import compress
+
+record_size = 4096
+image_types = {"image/jpeg", "image/png", "image/gif", "image/bmp"}
+eof_record = b"\xe9\x8e\r\n"
+
+# books shorter than this aren't worth starting processes for
+parallel_threshold = 16
+
+link_re = re.compile(rb'href="#([^"]*)"')
+anchor_re = re.compile(rb'<[^>]*?\sid="([^"]*)"')
+img_re = re.compile(r'(<img\b[^>]*?)\ssrc="([^"]*)"([^>]*>)')
+style_re = re.compile(r"<style\b.*?</style>\s*", re.S)
+pagebreak = '<div class="pagebreak"></div>'
+
+
+def _pad(data, size=4):
+    return data + b"\0" * (-len(data) % size)
+
+
+def _filepos(pos):
+    return b"filepos=%010d" % pos
+
+
+def prepare_html(html, images, guide):
+    """
+    Turns the rendered book into Mobipocket markup, with links resolved.
+
+    images maps the src names used in the html to their image index (from 1);
+    other images are left out, having nothing to point at. guide is a list of
+    (type, title, anchor id).
+    """
+    html = style_re.sub("", html)
+    html = html.replace(pagebreak, "<mbp:pagebreak/>")
+    if html.lower().startswith("<!doctype"):
+        html = html[html.index(">") + 1 :].lstrip()
+
+    def image(m):
+        if m.group(2) not in images:
+            return ""
+        return '{} recindex="{:05d}"{}'.format(
+            m.group(1), images[m.group(2)], m.group(3)
+        )
+
+    html = img_re.sub(image, html)
+
+    refs = "".join(
+        '<reference type="{}" title="{}" href="#{}" />'.format(*g) for g in guide
+    )
+    html = html.replace("<head>", "<head><guide>{}</guide>".format(refs), 1)
+
+    # placeholders are fixed-width, so anchors don't move when they're filled
+    raw = html.encode("utf-8")
+    data = bytearray()
+    links = []
+    last = 0
+    for m in link_re.finditer(raw):
+        data += raw[last : m.start()]
+        links.append((len(data), m.group(1)))
+        data += _filepos(0)
+        last = m.end()
+    data += raw[last:]
+
+    anchors = {m.group(1): m.start() for m in anchor_re.finditer(data)}
+    for pos, name in links:
+        data[pos : pos + len(_filepos(0))] = _filepos(anchors.get(name, 0))
+    return bytes(data)
+
+
+def _overlap(text, end):
+    # the rest of a multibyte character that starts before the record boundary
+    tail = b""
+    for c in text[end : end + 3]:
+        if c & 0xC0 != 0x80:
+            break
+        tail += bytes([c])
+    return tail
+
+
+def text_records(text, pool=None):
+    chunks = [text[i : i + record_size] for i in range(0, len(text), record_size)]
+    if len(chunks) < parallel_threshold:
+        compressed = map(compress, chunks)
+    elif pool is not None:
+        compressed = pool.map(compress, chunks, chunksize=4)
+    else:
+        with ProcessPoolExecutor() as pool:
+            compressed = list(pool.map(compress, chunks, chunksize=4))
+
+    records = []
+    for i, data in enumerate(compressed):
+        tail = _overlap(text, (i + 1) * record_size)
+        records.append(data + tail + bytes([len(tail)]))
+    return records
+
+
+def _exth(items):
+    body = b"".join(
+        struct.pack(">II", kind, len(value) + 8) + value for kind, value in items
+    )
+    head = struct.pack(">4sII", b"EXTH", len(body) + 12, len(items))
+    return _pad(head + body)
+
+
+def header_record(meta, text_length, n_text, first_image, cover, layout):
+    title = meta["title"].encode("utf-8")
+    uid = zlib.crc32("{title}\0{author}".format(**meta).encode("utf-8"))
+
+    exth_items = [
+        (100, meta["author"].encode("utf-8")),
+        (101, meta["publisher"].encode("utf-8")),
+        (113, str(uid).encode("ascii")),
+        (501, b"EBOK"),
+        (503, title),
+        (524, meta.get("language", "en").encode("ascii")),
+    ]
+    if cover is not None:
+        exth_items += [
+            (201, struct.pack(">I", cover)),
+            (202, struct.pack(">I", cover)),
+            (203, struct.pack(">I", 0)),
+        ]
+    exth = _exth(exth_items)
+
+    none = 0xFFFFFFFF
+    head = bytearray(248)
+    struct.pack_into(">HHIHHHH", head, 0, 2, 0, text_length, n_text, record_size, 0, 0)
+    struct.pack_into(">4sIIIII", head, 16, b"MOBI", 232, 2, 65001, uid, 6)
+    # orthographic, inflection, index names and keys, extra indexes
+    struct.pack_into(">10I", head, 40, *[none] * 10)
+    struct.pack_into(
+        ">IIIIIII",
+        head,
+        80,
+        layout["first_extra"],
+        len(head) + len(exth),  # full name offset
+        len(title),
+        9,  # locale: english
+        0,
+        0,
+        6,  # minimum reader version
+    )
+    struct.pack_into(">I", head, 108, none if first_image is None else first_image)
+    struct.pack_into(">I", head, 128, 0x50)  # has EXTH
+    struct.pack_into(">IIII", head, 164, none, none, 0, 0)  # no DRM
+    # first and last content records: the text up to the last image
+    struct.pack_into(">HHI", head, 192, 1, layout["last_content"], 1)
+    struct.pack_into(">IIII", head, 200, layout["fcis"], 1, layout["flis"], 1)
+    struct.pack_into(">IIIII", head, 224, none, 0, none, none, 1)
+    struct.pack_into(">I", head, 244, none)
+
+    # room after the name for tools that like to rewrite metadata in place
+    return bytes(head) + exth + _pad(title + b"\0\0") + b"\0" * 1024
+
+
+def flis_record():
+    return struct.pack(
+        ">4sIHHIIHHIII", b"FLIS", 8, 65, 0, 0, 0xFFFFFFFF, 1, 3, 3, 1, 0xFFFFFFFF
+    )
+
+
+def fcis_record(text_length):
+    return struct.pack(
+        ">4sIIIIIIIIHHI", b"FCIS", 20, 16, 1, 0, text_length, 0, 32, 8, 1, 1, 0
+    )
+
+
+def palm_db(name, records):
+    now = int(time.time()) + 2082844800  # seconds since 1904
+    name = re.sub(rb"[^A-Za-z0-9]+", b"_", name.encode("ascii", "ignore"))[:31]
+    header = struct.pack(
+        ">32sHHIIIIII4s4sIIH",
+        name,
+        0,
+        0,
+        now,
+        now,
+        0,
+        0,
+        0,
+        0,
+        b"BOOK",
+        b"MOBI",
+        2 * len(records) - 1,
+        0,
+        len(records),
+    )
+    offset = len(header) + 8 * len(records) + 2
+    index = b""
+    for i, record in enumerate(records):
+        index += struct.pack(">IB", offset, 0) + (2 * i).to_bytes(3, "big")
+        offset += len(record)
+    return header + index + b"\0\0" + b"".join(records)
+
+
+def write_mobi(path, html, meta, images=(), cover=None, guide=(), pool=None):
+    """
+    Writes the rendered book to path.
+
+    meta has title, author, publisher and optionally language; images is a
+    list of (src name, bytes) in the order they should be stored, and cover
+    the index into it of the cover image. Text records are compressed on
+    pool, a ProcessPoolExecutor, or on a pool of our own.
+    """
+    images = list(images)
+    text = prepare_html(
+        html, {name: i + 1 for i, (name, _) in enumerate(images)}, guide
+    )
+    records = text_records(text, pool=pool)
+
+    n_text = len(records)
+    first_image = n_text + 1 if images else None
+    first_extra = n_text + 1
+    layout = {
+        "first_extra": first_extra,
+        "last_content": n_text + len(images),
+        "flis": first_extra + len(images),
+        "fcis": first_extra + len(images) + 1,
+    }
+    header = header_record(meta, len(text), n_text, first_image, cover, layout)
+
+    records = (
+        [header]
+        + records
+        + [data for _, data in images]
+        + [flis_record(), fcis_record(len(text)), eof_record]
+    )
+    with open(path, "wb") as f:
+        f.write(palm_db(meta["title"], records))
+    return path
@@ -0,0 +1,73 @@
+"""
+PalmDoc (LZ77-ish) compression, as used for MOBI text records.
+"""
+
+import struct
+
+max_distance = 2047
+min_length = 3
+max_length = 10
+
+
+def compress(data):
+    out = bytearray()
+    i = 0
+    n = len(data)
+    while i < n:
+        # back-references: the longest run we've seen in the last 2047 bytes
+        start = max(0, i - max_distance)
+        found = -1
+        if i + min_length <= n:
+            found = data.rfind(data[i : i + min_length], start, i)
+        if found >= 0:
+            length = min_length
+            for size in range(min(max_length, n - i), min_length, -1):
+                j = data.rfind(data[i : i + size], start, i)
+                if j >= 0:
+                    found, length = j, size
+                    break
+            out += struct.pack(">H", 0x8000 | ((i - found) << 3) | (length - 3))
+            i += length
+            continue
+
+        c = data[i]
+        if c == 0x20 and i + 1 < n and 0x40 <= data[i + 1] <= 0x7F:
+            # space followed by a printable character
+            out.append(data[i + 1] ^ 0x80)
+            i += 2
+        elif c == 0 or 0x09 <= c <= 0x7F:
+            out.append(c)
+            i += 1
+        else:
+            # up to 8 bytes that can't stand on their own
+            j = i
+            while j < n and j - i < 8 and (0x01 <= data[j] <= 0x08 or data[j] > 0x7F):
+                j += 1
+            out.append(j - i)
+            out += data[i:j]
+            i = j
+    return bytes(out)
+
+
+def decompress(data):
+    out = bytearray()
+    i = 0
+    n = len(data)
+    while i < n:
+        c = data[i]
+        i += 1
+        if 0x01 <= c <= 0x08:
+            out += data[i : i + c]
+            i += c
+        elif c <= 0x7F:
+            out.append(c)
+        elif c >= 0xC0:
+            out += b" "
+            out.append(c ^ 0x80)
+        else:
+            pair = (c << 8) | data[i]
+            i += 1
+            distance = (pair & 0x3FFF) >> 3
+            for _ in range((pair & 7) + 3):
+                out.append(out[-distance])
+    return bytes(out)
@@ -1,31 +1,336 @@
+from concurrent.futures import CancelledError, Future
+from contextlib import contextmanager
+from datetime import timedelta
 from functools import lru_cache, partial
 import hashlib
+import json
 import re
-
-from bs4 import BeautifulSoup, Comment
-from cachecontrol import CacheControl
-from cachecontrol.caches import FileCache
-from cachecontrol.heuristics import ExpiresAfter
-import requests
-from requests_futures.sessions import FuturesSession
+import sys
+import threading
+import time
 import unicodedata
+from urllib.parse import urlparse
+
+from .metrics import metrics
+
+
+class Throttle(object):
+    """
+    Spaces out requests to the same host by at least `delay` seconds, and
+    with `per_host` set, keeps at most that many in flight to each host.
+
+    With `shared` set to something with a reserve(host, delay) method, e.g.
+    a worker.JobQueue, the spacing is across every process using it.
+    """
+
+    def __init__(self, delay=0, per_host=None):
+        self.delay = delay
+        self.per_host = per_host
+        self.shared = None
+        self._lock = threading.Lock()
+        self._next = {}
+        self._slots = {}
+
+    @contextmanager
+    def slot(self, host):
+        if not self.per_host:
+            yield
+            return
+        with self._lock:
+            if host not in self._slots:
+                self._slots[host] = threading.Semaphore(self.per_host)
+            sem = self._slots[host]
+        with sem:
+            yield
+
+    def wait(self, host):
+        if not self.delay:
+            return
+        if self.shared is not None:
+            wait = self.shared.reserve(host, self.delay)
+        else:
+            with self._lock:
+                now = time.monotonic()
+                at = max(now, self._next.get(host, now))
+                self._next[host] = at + self.delay
+            wait = at - now
+        if wait > 0:
+            time.sleep(wait)
+
+
+throttle = Throttle()
+
+
+class OfflineMiss(IOError):
+    pass
+
+
+class Offline(object):
+    """
+    While enabled, requests are answered only from the cache; anything not
+    there fails straight away and is remembered in `misses`.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.misses = []
+        self._lock = threading.Lock()
+
+    def miss(self, url):
+        with self._lock:
+            self.misses.append(url)
+        raise OfflineMiss("Not in the cache: {}".format(url))
+
+    def report(self, file=sys.stderr):
+        urls = sorted(set(self.misses))
+        print("{} URLs missing from the cache:".format(len(urls)), file=file)
+        for url in urls:
+            print("  {}".format(url), file=file)
+
+
+offline = Offline()
+
+
+class SiteJar(object):
+    """
+    Headers sent with every request to one site, and a cookie jar of its own
+    that its responses fill: a site's session state, on top of the shared
+    transport. Made with site_jar(); Coalescing applies it.
+    """
+
+    def __init__(self):
+        self.headers = {}
+        self._cookies = None
+        self._lock = threading.Lock()
+
+    @property
+    def cookies(self):
+        with self._lock:
+            if self._cookies is None:
+                from requests.cookies import RequestsCookieJar
+
+                self._cookies = RequestsCookieJar()
+            return self._cookies
+
+    def apply(self, kwargs):
+        kwargs = dict(kwargs)
+        kwargs["headers"] = dict(self.headers, **(kwargs.get("headers") or {}))
+        cookies = self.cookies.copy()
+        cookies.update(kwargs.get("cookies") or {})
+        kwargs["cookies"] = cookies
+        # a hook rather than a done-callback, so the cookies are in the jar
+        # before anyone waiting on the response sees it
+        hooks = dict(kwargs.get("hooks") or {})
+        hooks["response"] = _listify(hooks.get("response")) + [self.extract]
+        kwargs["hooks"] = hooks
+        return kwargs
+
+    def extract(self, resp, **kwargs):
+        # a cached response's cookies are stale; the jar has newer ones
+        if not getattr(resp, "from_cache", False):
+            self.cookies.update(resp.cookies)
+
+
+def _listify(x):
+    if x is None:
+        return []
+    return list(x) if isinstance(x, (list, tuple)) else [x]
+
+
+site_jars = {}
+
+
+def site_jar(domain):
+    """
+    The SiteJar for requests to domain and its subdomains.
+    """
+    return site_jars.setdefault(domain, SiteJar())
+
+
+def find_site_jar(url):
+    netloc = urlparse(url).netloc
+    while "." in netloc and netloc not in site_jars:
+        _, netloc = netloc.split(".", 1)
+    return site_jars.get(netloc)
+
+
+def request_key(method, url, kwargs):
+    return json.dumps([method.upper(), url, kwargs], sort_keys=True, default=repr)
+
+
+class Handle(Future):
+    """
+    One caller's share of a download that Coalescing may have given others
+    too: cancelling it cancels the download only once every share has been.
+    """
 
+    def __init__(self, release):
+        super(Handle, self).__init__()
+        self._release = release
 
-session = requests.Session()
-cached = CacheControl(
-    session, heuristic=ExpiresAfter(hours=1), cache=FileCache(".webcache")
-)
-futures = FuturesSession(session=cached, max_workers=5)
+    def cancel(self):
+        if not super(Handle, self).cancel():
+            return False
+        self._release()
+        return True
 
 
-soupify = partial(BeautifulSoup, features="html5lib")
+def _forward(handle, fut):
+    if not handle.set_running_or_notify_cancel():
+        return
+    if fut.cancelled():
+        handle.set_exception(CancelledError())
+    elif fut.exception() is not None:
+        handle.set_exception(fut.exception())
+    else:
+        handle.set_result(fut.result())
+
+
+class Coalescing(object):
+    """
+    Wraps a FuturesSession so that a request identical to one still in
+    flight shares that request's download instead of starting its own;
+    each caller gets a Handle on it.
+    URLs are canonicalized, and get their site's SiteJar, on the way in.
+    Everything else is passed through to the wrapped session.
+    """
+
+    def __init__(self, futures):
+        self.futures = futures
+        # key -> [future, number of live handles]
+        self.in_flight = {}
+        # reentrant: cancelling a future runs its callbacks in this thread
+        self._lock = threading.RLock()
+
+    def request(self, method, url, **kwargs):
+        from .sites.registry import canonical_url
+
+        # so every spelling of a URL shares one download and cache entry
+        url = canonical_url(url)
+        key = request_key(method, url, kwargs)
+        jar = find_site_jar(url)
+        if jar is not None:
+            kwargs = jar.apply(kwargs)
+        with self._lock:
+            shared = self.in_flight.get(key)
+            if shared is None:
+                shared = [self.futures.request(method, url, **kwargs), 0]
+                self.in_flight[key] = shared
+                shared[0].add_done_callback(partial(self._done, key, shared))
+            else:
+                metrics.count("coalesced_requests_total")
+            shared[1] += 1
+        handle = Handle(partial(self._release, key, shared))
+        shared[0].add_done_callback(partial(_forward, handle))
+        return handle
+
+    def _done(self, key, shared, _):
+        with self._lock:
+            if self.in_flight.get(key) is shared:
+                del self.in_flight[key]
+
+    def _release(self, key, shared):
+        with self._lock:
+            shared[1] -= 1
+            if shared[1] == 0:
+                shared[0].cancel()
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request("HEAD", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.futures, name)
+
+
+# read by `transport` when it's built, so set these through configure() first
+settings = {
+    "workers": 5,  # threads in the shared FuturesSession
+    "pool_size": 10,  # connections kept open per host
+    "pool_hosts": 10,  # hosts to keep connection pools for
+}
+
+
+# (pattern, lifetime) pairs; a response is cached for the lifetime of the
+# first pattern found in its URL, else for default_cache_ttl. Expired
+# entries are revalidated with If-None-Match / If-Modified-Since.
+cache_policies = []
+default_cache_ttl = timedelta(hours=1)
+
+
+def cache_policy(pattern, **lifetime):
+    cache_policies.append((re.compile(pattern), timedelta(**lifetime)))
+
+
+def cache_ttl(url):
+    for pattern, ttl in cache_policies:
+        if pattern.search(url):
+            return ttl
+    return default_cache_ttl
+
+
+cache_policy(r"\.(?:jpe?g|png|gif|webp|svg)(?:\?|$)", days=365)
+
+
+def configure(**kwargs):
+    if "make_ebook.transport" in sys.modules:
+        raise RuntimeError("the network stack has already been built")
+    unknown = set(kwargs) - set(settings)
+    if unknown:
+        raise TypeError("unknown settings {}".format(", ".join(sorted(unknown))))
+    settings.update(kwargs)
+
+
+# the network stack is only built the first time a site module asks for it
+def __getattr__(name):
+    if name in {"session", "cached", "futures"}:
+        from . import transport
+
+        return getattr(transport, name)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def preconnect(url):
+    """
+    Opens a connection to url's host in the background, building the network
+    stack on the way, so it's ready by the time the first real request is.
+    """
+    parsed = urlparse(url)
+    if parsed.scheme not in {"http", "https"}:
+        return
+
+    def connect():
+        from .transport import futures
+
+        try:
+            futures.head(
+                "{}://{}/".format(parsed.scheme, parsed.netloc),
+                allow_redirects=False,
+                timeout=10,
+            ).result()
+        except Exception:
+            pass
+
+    threading.Thread(target=connect, daemon=True).start()
+
+
+def soupify(markup):
+    from bs4 import BeautifulSoup
+
+    return BeautifulSoup(markup, features="html5lib")
 
 
 def soupify_request(req):
     r = req.result()
     if not r.ok:
         raise IOError("Error: {}".format(r.status_code))
-    return soupify(r.content)
+    with metrics.timer("parse_seconds_total", stage="soupify"):
+        return soupify(r.content)
 
 
 def slugify(s):
@@ -43,13 +348,22 @@ def stripright(s, end):
     return s[: -len(end)] if s.endswith(end) else s
 
 
+# every writer declares and writes UTF-8; set this to have gather_bits write
+# everything non-ASCII as &#NNNN; references instead, for picky readers
+char_refs = False
+
+
+@metrics.timed("parse_seconds_total", stage="gather_bits")
 def gather_bits(bits):
-    return "".join(
+    from bs4 import Comment
+
+    text = "".join(
         [
             unicodedata.normalize("NFKC", str(b))
-            .encode("ascii", "xmlcharrefreplace")
-            .decode("ascii")
             for b in bits
             if not isinstance(b, Comment)
         ]
     ).strip()
+    if char_refs:
+        text = text.encode("ascii", "xmlcharrefreplace").decode("ascii")
+    return text
@@ -0,0 +1,131 @@
+"""
+Per-run numbers: requests, cache hits, bytes, time spent parsing and
+writing, chapters per second and peak memory, written out as JSON or as a
+Prometheus textfile.
+"""
+
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+
+class Metrics(object):
+    def __init__(self):
+        self.path = None
+        self.started = time.time()
+        self.counters = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def count(self, name, n=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] += n
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.count(name, time.perf_counter() - start, **labels)
+
+    def timed(self, name, **labels):
+        def decorator(f):
+            @wraps(f)
+            def wrapper(*args, **kwargs):
+                with self.timer(name, **labels):
+                    return f(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def request(self, host, from_cache, size):
+        cache = "hit" if from_cache else "miss"
+        self.count("requests_total", host=host, cache=cache)
+        if not from_cache:
+            self.count("response_bytes_total", size, host=host)
+
+    def snapshot(self):
+        with self._lock:
+            return sorted(self.counters.items())
+
+    def total(self, name):
+        return sum(v for (n, _), v in self.snapshot() if n == name)
+
+    @staticmethod
+    def peak_rss():
+        if resource is None:
+            return None
+        peak = max(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+        )
+        return peak if sys.platform == "darwin" else peak * 1024
+
+    def gauges(self):
+        elapsed = time.time() - self.started
+        hits = sum(
+            v
+            for (n, labels), v in self.snapshot()
+            if n == "requests_total" and ("cache", "hit") in labels
+        )
+        requests = self.total("requests_total")
+        gauges = {
+            "run_seconds": elapsed,
+            "cache_hit_ratio": hits / requests if requests else 0.0,
+            "chapters_per_second": self.total("chapters_total") / elapsed,
+        }
+        rss = self.peak_rss()
+        if rss is not None:
+            gauges["peak_rss_bytes"] = rss
+        return gauges
+
+    def as_dict(self):
+        counters = defaultdict(list)
+        for (name, labels), value in self.snapshot():
+            counters[name].append(dict(labels, value=value))
+        return {"counters": dict(counters), "gauges": self.gauges()}
+
+    def as_prometheus(self):
+        lines = []
+        seen = set()
+        for (name, labels), value in self.snapshot():
+            name = "make_ebook_" + name
+            if name not in seen:
+                seen.add(name)
+                lines.append("# TYPE {} counter".format(name))
+            if labels:
+                name += "{%s}" % ",".join('{}="{}"'.format(k, v) for k, v in labels)
+            lines.append("{} {}".format(name, value))
+        for name, value in sorted(self.gauges().items()):
+            lines.append("# TYPE make_ebook_{} gauge".format(name))
+            lines.append("make_ebook_{} {}".format(name, value))
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        if path.endswith(".json"):
+            data = json.dumps(self.as_dict(), indent=2)
+        else:
+            data = self.as_prometheus()
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def flush(self):
+        if self.path is not None:
+            self.write(self.path)
+
+
+metrics = Metrics()
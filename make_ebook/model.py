@@ -0,0 +1,147 @@
+"""
+The render model: a story compiled once into plain immutable records, so the
+templates and writers never go back to the sites' lazy properties.
+"""
+
+from collections import namedtuple
+
+from .helpers import hashify
+
+
+Note = namedtuple("Note", ["key", "name", "text", "chapter", "source"])
+NoteRef = namedtuple("NoteRef", ["key", "name", "source"])
+
+
+def intern_notes(chapters):
+    """
+    Collects each distinct note once, keyed by a hash of its text, so notes
+    repeated on every chapter only appear once in the Notes section.
+
+    Returns the notes in order of first appearance, and a dict from chapter
+    id to its (pre, post) lists of NoteRefs. A note links back to the first
+    chapter that carries it.
+    """
+    notes = {}
+    refs = {}
+    for chap in chapters:
+        both = []
+        for where, chap_notes in [("pre", chap.notes_pre), ("post", chap.notes_post)]:
+            these = []
+            for i, (name, text) in enumerate(chap_notes):
+                key = "note-{}".format(hashify(text.strip())[:16])
+                # a chapter can carry the same note twice
+                source = "source-{}-{}-{}{}".format(key, chap.id, where, i)
+                if key not in notes:
+                    notes[key] = Note(key, name, text, chap, source)
+                these.append(NoteRef(key, name, source))
+            both.append(tuple(these))
+        refs[chap.id] = tuple(both)
+    return tuple(notes.values()), refs
+
+
+class BookChapter(
+    namedtuple(
+        "BookChapter", ["id", "title", "text", "toc_extra", "notes_pre", "notes_post"]
+    )
+):
+    __slots__ = ()
+
+
+class BookExtra(namedtuple("BookExtra", ["id", "name", "mimetype", "attrs", "source"])):
+    __slots__ = ()
+
+    # the bytes stay wherever the extra keeps them until a writer asks
+    content = property(lambda self: self.source.content)
+
+    @property
+    def extra_attrs(self):
+        return " ".join('{}="{}"'.format(k, v) for k, v in self.attrs)
+
+    @property
+    def is_cover(self):
+        return ("properties", "cover-image") in self.attrs
+
+
+class Book(
+    namedtuple(
+        "Book",
+        [
+            "id",
+            "title",
+            "author",
+            "publisher",
+            "default_out_name",
+            "chapters",
+            "extra",
+            "notes",
+            "note_refs",
+        ],
+    )
+):
+    __slots__ = ()
+
+    any_notes = property(lambda self: bool(self.notes))
+
+    def with_chapters(self, chapters, **changes):
+        """
+        A book with just these chapters, their notes, and the extras they use
+        (plus the cover).
+        """
+        notes, note_refs = intern_notes(chapters)
+        texts = [c.text for c in chapters]
+        texts += [text for c in chapters for _, text in c.notes_pre + c.notes_post]
+        extra = tuple(
+            x
+            for x in self.extra
+            if x.is_cover or any('"{}"'.format(x.name) in t for t in texts)
+        )
+        return self._replace(
+            chapters=tuple(chapters),
+            extra=extra,
+            notes=notes,
+            note_refs=note_refs,
+            **changes
+        )
+
+
+def compile_chapter(chap):
+    return BookChapter(
+        id=str(chap.id),
+        title=chap.title,
+        text=chap.text,
+        toc_extra=chap.toc_extra,
+        notes_pre=tuple(tuple(n) for n in chap.notes_pre),
+        notes_post=tuple(tuple(n) for n in chap.notes_post),
+    )
+
+
+def compile_extra(x):
+    return BookExtra(
+        id=x.id,
+        name=x.name,
+        mimetype=x.mimetype,
+        attrs=tuple(x.attrs.items()),
+        source=x,
+    )
+
+
+def compile_story(story):
+    """
+    Reads every property of story exactly once, into a Book.
+    """
+    if isinstance(story, Book):
+        return story
+
+    chapters = tuple(compile_chapter(c) for c in story.chapters)
+    notes, note_refs = intern_notes(chapters)
+    return Book(
+        id=str(story.id),
+        title=story.title,
+        author=story.author,
+        publisher=story.publisher,
+        default_out_name=story.default_out_name,
+        chapters=chapters,
+        extra=tuple(compile_extra(x) for x in story.extra),
+        notes=notes,
+        note_refs=note_refs,
+    )
@@ -0,0 +1,67 @@
+"""
+Prefetch mode: download what builds of a list of stories will need into the
+HTTP cache ahead of time, so the builds themselves run from a warm cache.
+"""
+
+from concurrent.futures import ThreadPoolExecutor, wait
+import sys
+
+from .sites import get_story, get_works
+
+
+def prefetch_story(url, extras=True):
+    """
+    Downloads url's table of contents, then every chapter's pages (and
+    comments, where a site has them), and with extras its images too.
+    Nothing is extracted or rendered; finding the extras does mean parsing
+    the chapter pages they're linked from, so that's skipped without extras.
+
+    Returns how many downloads failed.
+    """
+    story = get_story(url)
+    reqs = [req for chap in story.chapters for req in chap.pending]
+    wait(reqs)
+    if extras:
+        xs = [x.req for x in story.extra if hasattr(x, "req")]
+        wait(xs)
+        reqs += xs
+    return sum(1 for req in reqs if req.exception() or not req.result().ok)
+
+
+def expand(urls):
+    """
+    The story URLs in urls, with author pages replaced by their works.
+    """
+    for url in urls:
+        works = get_works(url)
+        if works is None:
+            yield url
+        else:
+            for work in works:
+                yield work.url
+
+
+def prefetch(urls, jobs=2, extras=True):
+    """
+    Prefetches each story in urls, `jobs` at a time; returns the URLs of
+    those that couldn't be fully fetched.
+    """
+    failed = []
+
+    def one(url):
+        try:
+            errors = prefetch_story(url, extras=extras)
+        except Exception as e:
+            print("ERROR on {}: {}".format(url, e), file=sys.stderr)
+            failed.append(url)
+            return
+        if errors:
+            print("{} downloads failed for {}".format(errors, url), file=sys.stderr)
+            failed.append(url)
+        else:
+            print("Fetched {}".format(url), file=sys.stderr)
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        for fut in [pool.submit(one, url) for url in expand(urls)]:
+            fut.result()
+    return failed
@@ -1,15 +1,39 @@
-from .registry import get_site
+from .base import ChapterSelection
+from .registry import (
+    canonical_url,
+    declare,
+    get_author,
+    get_site,
+    load_all,
+    register_canonical,
+)
 
-from . import ao3
-from . import fictionmania
-from . import hentai_foundry
-from . import literotica
-from . import mcstories
-from . import scribblehub
-from . import take_a_lemon
-from . import tgs
 
-
-def get_story(path):
+def get_story(path, select=None):
+    """
+    The story at path; with select, a ChapterSelection, only those chapters
+    of it are requested.
+    """
     cls = get_site(path)
-    return cls(path)
+    if select is None:
+        return cls(path)
+    if not cls.selectable:
+        raise ValueError("{} can't select chapters".format(cls.__name__))
+    return cls(path, select=select)
+
+
+def get_works(path):
+    """
+    The works listed on an author page, or None if path isn't one.
+    """
+    cls = get_author(path)
+    if cls is None:
+        return None
+    return cls(path).works
+
+
+def get_change_signal(path):
+    """
+    A fingerprint of the story's chapter list that changes when it does.
+    """
+    return get_site(path).change_signal(path)
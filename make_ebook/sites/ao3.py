@@ -1,30 +1,54 @@
-from urllib.parse import urlparse
+import re
+from urllib.parse import parse_qsl, urlencode, urljoin, urlparse
 
-from ..helpers import futures, gather_bits, soupify_request, stripright
-from .base import Story, Chapter
-from .registry import register
+from ..helpers import (
+    cache_policy,
+    futures,
+    gather_bits,
+    slugify,
+    soupify_request,
+    stripright,
+)
+from .base import Author, Story, Chapter, Work, links_signal, revalidate
+from .registry import register, register_author, register_canonical, rehost
 
 
 work_fmt = "https://archiveofourown.org/works/{}?view_adult=true"
 chap_fmt = "https://archiveofourown.org/works/{}/chapters/{}?view_adult=true"
+# the text of a single-chapter work; the same page as work_fmt, but kept apart
+# so it's cached like a chapter rather than a table of contents
+full_fmt = "https://archiveofourown.org/works/{}?view_adult=true&view_full_work=true"
+author_re = re.compile(r"^/users/([^/]+)(?:/pseuds/([^/]+))?(?:/works)?/?$")
+work_path_re = re.compile(r"^/works/\d+$")
+
+cache_policy(r"archiveofourown\.org/works/\d+(?:/chapters/|.*view_full_work)", days=30)
+cache_policy(r"archiveofourown\.org/(?:works|users)/", minutes=10)
+
+
+@register_canonical("archiveofourown.org")
+def canonical_ao3(url):
+    r = urlparse(rehost(url, "https", "archiveofourown.org"))
+    if work_path_re.match(r.path) or "/chapters/" in r.path:
+        query = parse_qsl(r.query)
+        if "view_adult" not in dict(query):
+            query.append(("view_adult", "true"))
+        # sorted, so each spelling of a URL is one cache key; the formats
+        # above are written in that order already
+        r = r._replace(query=urlencode(sorted(query)))
+    return r.geturl()
 
 
 @register(domain="archiveofourown.org")
 class AO3Story(Story):
     publisher = "archiveofourown.org"
     author = chapters = title = None
+    selectable = True
 
-    def __init__(self, id):
+    def __init__(self, id, select=None):
         super(AO3Story, self).__init__()
 
         if "archiveofourown.org/" in id:
-            r = urlparse(id)
-            assert r.netloc in {"www.archiveofourown.org", "archiveofourown.org"}
-            assert r.path.startswith("/works/")
-            pth = r.path[len("/works/") :]
-            if "/" in pth:
-                pth = pth[: pth.index("/")]
-            id = int(pth)
+            id = self.parse_url(id)
 
         self.id = id
         self.url = work_fmt.format(self.id)
@@ -36,16 +60,64 @@ class AO3Story(Story):
 
         selector = p.find(id="selected_id")
         if selector:
-            self.chapters = [
-                AO3Chapter(self.id, o.attrs["value"])
-                for o in selector.find_all("option")
-            ]
+            chap_ids = [o.attrs["value"] for o in selector.find_all("option")]
         else:
-            self.chapters = [AO3Chapter(self.id, only_chapter)]
+            chap_ids = [only_chapter]
+        if select is not None:
+            chap_ids = select.pick(chap_ids)
+        self.chapters = [AO3Chapter(self.id, c) for c in chap_ids]
 
     def __repr__(self):
         return "AO3Story({})".format(self.id)
 
+    @staticmethod
+    def parse_url(url):
+        r = urlparse(url)
+        assert r.netloc in {"www.archiveofourown.org", "archiveofourown.org"}
+        assert r.path.startswith("/works/")
+        pth = r.path[len("/works/") :]
+        if "/" in pth:
+            pth = pth[: pth.index("/")]
+        return int(pth)
+
+    @classmethod
+    def change_signal(cls, url):
+        # the chapter dropdown on the work page
+        req = futures.get(work_fmt.format(cls.parse_url(url)), headers=revalidate)
+        return links_signal(req, "#selected_id option", "value")
+
+
+@register_author(domain="archiveofourown.org")
+class AO3Author(Author):
+    path_re = author_re
+    works = None
+
+    def __init__(self, url):
+        user, pseud = author_re.match(urlparse(url).path).groups()
+        self.url = "https://archiveofourown.org/users/{}".format(user)
+        if pseud:
+            self.url += "/pseuds/{}".format(pseud)
+        self.url += "/works"
+
+        (first,) = self.get_pages([self.url])
+        nums = [a.text.strip() for a in first.select("ol.pagination li a")]
+        num_pages = max([int(n) for n in nums if n.isdigit()], default=1)
+        pages = [first] + self.get_pages(
+            "{}?page={}".format(self.url, n) for n in range(2, num_pages + 1)
+        )
+
+        self.works = []
+        for p in pages:
+            for h in p.select("li.work.blurb h4.heading"):
+                a = h.find("a", href=work_path_re)
+                title = a.text.strip()
+                self.works.append(
+                    Work(urljoin(self.url, a["href"]), title, slugify(title))
+                )
+
+    def __repr__(self):
+        return "AO3Author({!r})".format(self.url)
+
 
 only_chapter = ("all",)
 
@@ -58,9 +130,9 @@ class AO3Chapter(Chapter):
         self.chap_id = chap_id
         self.id = f"{work_id}_{chap_id}"
         if chap_id == only_chapter:
-            self.url = chap_fmt.format(work_id, chap_id)
+            self.url = full_fmt.format(work_id)
         else:
-            self.url = work_fmt.format(work_id)
+            self.url = chap_fmt.format(work_id, chap_id)
         self.req = futures.get(self.url)
 
     def __repr__(self):
@@ -1,9 +1,11 @@
 from abc import ABC, abstractmethod
+from collections import namedtuple
 import os
 from urllib.parse import urlparse
 from uuid import uuid4 as get_uuid
 
-from ..helpers import futures, slugify
+from .. import helpers
+from ..helpers import hashify, slugify, soupify_request
 
 
 class Extra(object):
@@ -13,7 +15,7 @@ class Extra(object):
 
     def __init__(self, url, name=None):
         self.url = url
-        self.req = futures.get(self.url)
+        self.req = helpers.futures.get(self.url)
 
         basename, ext = os.path.splitext(os.path.basename(urlparse(url).path))
         if name is None:
@@ -48,6 +50,14 @@ class Chapter(ABC):
     """
     notes_pre = property(lambda self: [])
     notes_post = property(lambda self: [])
+    extra = property(lambda self: [])
+
+    @property
+    def pending(self):
+        """
+        The downloads this chapter's title and text are extracted from.
+        """
+        return [self.req] if hasattr(self, "req") else []
 
     @property
     def id(self):
@@ -81,7 +91,73 @@ class Chapter(ABC):
         self._toc_extra = val
 
 
+# asks the cache to revalidate (If-None-Match / If-Modified-Since) even if
+# the entry hasn't expired yet
+revalidate = {"Cache-Control": "max-age=0"}
+
+
+def links_signal(req, selector="a", attr="href"):
+    p = soupify_request(req)
+    return hashify("\n".join(a.get(attr, "") for a in p.select(selector)))
+
+
+class ChapterSelection(object):
+    """
+    Which chapters of a story to build, by their 1-based position in its
+    table of contents: e.g. "500-550", "1,3,10-" or "-5".
+    """
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.ranges = []
+        for part in spec.split(","):
+            lo, sep, hi = part.strip().partition("-")
+            if not (lo or hi):
+                raise ValueError("empty chapter range in {!r}".format(spec))
+            lo = int(lo) if lo else 1
+            hi = (int(hi) if hi else None) if sep else lo
+            if lo < 1 or (hi is not None and hi < lo):
+                raise ValueError("bad chapter range {!r}".format(part))
+            self.ranges.append((lo, hi))
+
+    def __contains__(self, n):
+        return any(lo <= n and (hi is None or n <= hi) for lo, hi in self.ranges)
+
+    def __str__(self):
+        return self.spec
+
+    def pick(self, items):
+        """
+        The items at the selected positions, in order.
+        """
+        picked = [x for n, x in enumerate(items, 1) if n in self]
+        if not picked:
+            raise ValueError(
+                "no chapters in {} out of {}".format(self.spec, len(items))
+            )
+        return picked
+
+
 class Story(ABC):
+    # whether the constructor takes select=ChapterSelection(...), and only
+    # requests the chapters it picks
+    selectable = False
+
+    # where change_signal finds the chapter list on the story's page, and
+    # which attribute of each match it hashes
+    toc_selector = "a"
+    toc_attr = "href"
+
+    @classmethod
+    def change_signal(cls, url):
+        """
+        A cheap fingerprint of the story's chapter list, for watch mode; by
+        default a hash of the toc_selector matches on url, revalidated with
+        the server.
+        """
+        req = helpers.futures.get(url, headers=revalidate)
+        return links_signal(req, cls.toc_selector, cls.toc_attr)
+
     @property
     def any_notes(self):
         return any(
@@ -132,3 +208,28 @@ class Story(ABC):
     @extra.setter
     def extra(self, val):
         self._extra = val
+
+
+Work = namedtuple("Work", ["url", "title", "out_name"])
+
+
+class Author(ABC):
+    """
+    An author's listing page, expanded into the works it links to.
+    """
+
+    path_re = None
+
+    @classmethod
+    def matches(cls, url):
+        return cls.path_re.match(urlparse(url).path) is not None
+
+    @staticmethod
+    def get_pages(urls):
+        reqs = [helpers.futures.get(url) for url in urls]
+        return [soupify_request(req) for req in reqs]
+
+    @property
+    @abstractmethod
+    def works(self):
+        pass
@@ -2,9 +2,9 @@ from collections import namedtuple
 import re
 from urllib.parse import parse_qs, urljoin, urlparse
 
-from ..helpers import futures, gather_bits, soupify_request
-from .base import Story, Chapter, Extra
-from .registry import register
+from ..helpers import cache_policy, futures, gather_bits, slugify, soupify_request
+from .base import Author, Story, Chapter, Extra, Work
+from .registry import register, register_author, register_canonical, rehost
 
 
 fm_urls = {
@@ -12,6 +12,10 @@ fm_urls = {
     "html": "https://fictionmania.tv/stories/readhtmlstory.html?storyID={}",
 }
 fm_js_start = "javascript:newPopwin('"
+fm_story_re = re.compile(r"^/stories/read(\w+)story\.html$")
+
+cache_policy(r"fictionmania\.tv/stories/read", days=30)
+cache_policy(r"fictionmania\.tv/searchdisplay/", minutes=10)
 
 
 class FMChapter(Chapter):
@@ -24,6 +28,11 @@ class FMChapter(Chapter):
             setattr(self, k, v)
 
 
+@register_canonical("fictionmania.tv")
+def canonical_fictionmania(url):
+    return rehost(url, "https", "fictionmania.tv")
+
+
 @register(domain="fictionmania.tv")
 @register(prefix=fm_js_start)
 class FMStory(Story):
@@ -102,4 +111,31 @@ class FMStory(Story):
 
         text = gather_bits(bits)
 
-        self.chapters = [FMChapter(title=self.title, text=text)]
+        self.chapters = [FMChapter(id=self.id, title=self.title, text=text)]
+
+
+@register_author(domain="fictionmania.tv")
+class FMAuthor(Author):
+    path_re = re.compile(r"^/searchdisplay/authordisplay\.html$")
+    works = None
+
+    def __init__(self, url):
+        self.url = url
+        (p,) = self.get_pages([self.url])
+
+        seen = set()
+        self.works = []
+        for a in p.find_all("a", href=re.compile("storyID=")):
+            r = urlparse(urljoin(self.url, a["href"]))
+            m = fm_story_re.match(r.path)
+            title = a.text.strip()
+            if not m or not title:
+                continue
+            (id,) = map(int, parse_qs(r.query)["storyID"])
+            if id not in seen:
+                seen.add(id)
+                mode = m.group(1) if m.group(1) in fm_urls else "x"
+                self.works.append(Work(fm_urls[mode].format(id), title, slugify(title)))
+
+    def __repr__(self):
+        return "FMAuthor({!r})".format(self.url)
@@ -1,58 +1,74 @@
-import requests
-from requests_futures.sessions import FuturesSession
 from urllib.parse import urljoin
 
-from ..helpers import gather_bits, soupify, soupify_request
+from ..helpers import (
+    cache_policy,
+    futures,
+    gather_bits,
+    hashify,
+    site_jar,
+    soupify_request,
+)
 from .base import Chapter, Story
-from .registry import register
+from .registry import register, register_canonical, rehost
+
+
+# need to be slightly careful around cookies/etc
+jar = site_jar("hentai-foundry.com")
+jar.headers["User-Agent"] = "Mozilla/5"
+
+# chapters are /stories/user/NAME/STORY-ID/Title/CHAPTER-ID/Title
+cache_policy(r"hentai-foundry\.com/stories/user/[^/]+/\d+/[^/]+/\d+", days=30)
+cache_policy(r"hentai-foundry\.com/(?:stories|user)/", minutes=10)
+
+
+@register_canonical("hentai-foundry.com")
+def canonical_hentai_foundry(url):
+    return rehost(url, "https", "www.hentai-foundry.com")
 
 
 @register("hentai-foundry.com")
 class HFStory(Story):
     publisher = "hentai-foundry.com"
     author = chapters = title = None
+    selectable = True
+    toc_selector = ".boxbody p > a"
 
-    def __init__(self, url):
+    def __init__(self, url, select=None):
         self.url = url
-
-        # need to be slightly careful around cookies/etc
-        self.session = requests.Session()
-        self.session.headers["User-Agent"] = "Mozilla/5"
-        self.futures = FuturesSession(session=self.session, max_workers=5)
-
-        r = self.session.get(self.url)
-        if not r.ok:
-            raise IOError("Error: {}".format(r.status_code))
-        self.soup = soupify(r.content)
+        self.soup = soupify_request(futures.get(self.url))
 
         a = self.soup.find(id="frontPage_link")
         if a:
-            r = self.session.get(
-                urljoin(self.url, a["href"] + "&size=1000"), cookies=r.cookies
+            # the way in sets the session cookies (kept in jar), so it needs
+            # a fresh response rather than one with a cached Set-Cookie
+            self.soup = soupify_request(
+                futures.get(
+                    urljoin(self.url, a["href"] + "&size=1000"),
+                    headers={"Cache-Control": "no-cache"},
+                )
             )
-            if not r.ok:
-                raise IOError("Error: {}".format(r.status_code))
-            self.soup = soupify(r.content)
 
         if self.soup.find(id="viewChapter"):
             self.url = url = urljoin(
                 url, self.soup.select_one(".storyRead a:not(.pdfLink)")["href"]
             )
-            self.soup = soupify_request(self.futures.get(url))
+            self.soup = soupify_request(futures.get(url))
 
         self.author = self.soup.select_one(".storyInfo a[href^='/user']").text.strip()
         self.title = self.soup.select_one(".titlebar a[href^='/stories']").text.strip()
 
         box = self.soup.find("h2", text="Chapters").parent.find(class_="boxbody")
-        self.chapters = [
-            HFChapter(self.futures.get(urljoin(self.url, p.find("a")["href"])))
-            for p in box.find_all("p")
-        ]
+        urls = [urljoin(self.url, p.find("a")["href"]) for p in box.find_all("p")]
+        if select is not None:
+            urls = select.pick(urls)
+        self.chapters = [HFChapter(futures.get(u), id=hashify(u)) for u in urls]
 
 
 class HFChapter(Chapter):
-    def __init__(self, req):
+    def __init__(self, req, id=None):
         self.req = req
+        if id is not None:
+            self.id = id
 
     @property
     def soup(self):
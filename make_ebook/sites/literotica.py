@@ -1,17 +1,32 @@
-from html.parser import HTMLParser
+import html
 import re
+from urllib.parse import parse_qs, urlparse
 
-from ..helpers import futures, gather_bits, soupify_request
-from .base import Chapter, Story
-from .registry import register
+from ..helpers import cache_policy, futures, gather_bits, soupify_request
+from .base import Author, Chapter, Story, Work
+from .registry import register, register_author, register_canonical, rehost
 
 # TODO: new site format...
 
+story_fmt = "https://www.literotica.com/s/{}"
+member_fmt = "https://www.literotica.com/stories/memberpage.php?uid={}&page=submissions"
+story_re = re.compile(r"literotica\.com/s/([^\?]*)")
+
+cache_policy(r"literotica\.com/s/", days=30)
+cache_policy(r"literotica\.com/stories/memberpage\.php", minutes=10)
+
+
+@register_canonical("literotica.com")
+def canonical_literotica(url):
+    return rehost(url, "https", "www.literotica.com")
+
 
 @register(domain="literotica.com")
 class LitSeries(Story):
     publisher = "Literotica.com"
     chapters = None
+    # the other parts of a series, and the story's own pages
+    toc_selector = "#b-series a, a[href*='?page=']"
 
     def __init__(self, first_story_id):
         super(LitSeries, self).__init__()
@@ -43,6 +58,44 @@ class LitSeries(Story):
         return self.id
 
 
+@register_author(domain="literotica.com")
+class LitAuthor(Author):
+    path_re = re.compile(r"^/stories/memberpage\.php$")
+    works = None
+
+    def __init__(self, url):
+        (uid,) = parse_qs(urlparse(url).query)["uid"]
+        self.url = member_fmt.format(uid)
+        (p,) = self.get_pages([self.url])
+
+        # series parts are listed under a ser-ttl row; LitSeries only needs
+        # the first one to find the rest
+        self.works = []
+        series_name = None
+        for tr in p.find_all("tr"):
+            classes = tr.get("class", [])
+            if "ser-ttl" in classes:
+                series_name = tr.text
+                continue
+
+            a = tr.find("a", href=story_re)
+            if a is None:
+                continue
+            if "sl" in classes:
+                if series_name is None:
+                    continue
+                title = series_name[: series_name.rfind(":")]
+                series_name = None
+            else:
+                title = a.text.strip()
+
+            id = story_re.search(a["href"]).group(1)
+            self.works.append(Work(story_fmt.format(id), title, id))
+
+    def __repr__(self):
+        return "LitAuthor({!r})".format(self.url)
+
+
 class LitStory(Chapter):
     def __init__(self, id):
         super(LitStory, self).__init__()
@@ -52,8 +105,28 @@ class LitStory(Chapter):
             id = re.match(pat, id).group(1)
 
         self.id = str(id)
-        self.url = "https://www.literotica.com/s/{}".format(self.id)
+        self.url = story_fmt.format(self.id)
         self._meta_dict = None
+        self._first_page = None
+        # every part of a series starts on its first page; ask for them all now
+        self._first = futures.get(f"{self.url}?page=1")
+
+    @property
+    def pending(self):
+        # how many pages there are is on the first one, so that's waited for
+        nums = range(2, self.count_pages(self.first_page) + 1)
+        return [self._first] + [futures.get(f"{self.url}?page={n}") for n in nums]
+
+    @property
+    def first_page(self):
+        if self._first_page is None:
+            self._first_page = soupify_request(self._first)
+        return self._first_page
+
+    @staticmethod
+    def count_pages(p):
+        s = p.find("span", class_="b-pager-caption-t").text
+        return int(re.match(r"(\d+) Pages?:?$", s).group(1))
 
     def get_pages(self, nums):
         reqs = [futures.get(f"{self.url}?page={n}") for n in nums]
@@ -77,21 +150,20 @@ class LitStory(Chapter):
             return self._meta_dict
 
         self._meta_dict = d = {}
-        p = self.get_page(1)
+        p = self.first_page
 
         author_link = p.find("span", class_="b-story-user-y").find("a")
         d["author"] = author_link.get_text()
         d["author_link"] = author_link["href"]
 
         t = p.find("title").get_text()
-        t = HTMLParser().unescape(t)
+        t = html.unescape(t)
         # rip out " - Literotica.com"
         d["title"], d["category"] = t[:-17].rsplit(" - ", 1)
 
         d["description"] = p.find("meta", {"name": "description"})["content"]
 
-        s = p.find("span", class_="b-pager-caption-t").text
-        d["num_pages"] = int(re.match("(\d+) Pages?:?$", s).group(1))
+        d["num_pages"] = self.count_pages(p)
 
         author_page = soupify_request(futures.get(d["author_link"]))
         a = author_page.find("a", href=lambda s: self.id in s)
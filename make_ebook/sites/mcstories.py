@@ -1,16 +1,31 @@
-from urllib.parse import urlparse
+import re
+from urllib.parse import urljoin, urlparse
 
-from ..helpers import futures, gather_bits, soupify_request
-from .base import Story, Chapter
-from .registry import register
+from ..helpers import cache_policy, futures, gather_bits, slugify, soupify_request
+from .base import Author, Story, Chapter, Work
+from .registry import register, register_author, register_canonical, rehost
+
+
+story_path_re = re.compile(r"^/([^/]+)/(?:index\.html)?$")
+not_stories = {"Authors", "Tags", "Titles"}
+
+cache_policy(r"mcstories\.com/(?:[^/]+/(?:index\.html)?$|Authors/)", minutes=10)
+cache_policy(r"mcstories\.com/[^/]+/[^/]+\.html$", days=30)
+
+
+@register_canonical("mcstories.com")
+def canonical_mcstories(url):
+    return rehost(url, "https", "mcstories.com")
 
 
 @register(domain="mcstories.com")
 class MCSStory(Story):
     publisher = "mcstories.com"
     author = chapters = title = None
+    selectable = True
+    toc_selector = "table#index a, div.chapter a"
 
-    def __init__(self, id):
+    def __init__(self, id, select=None):
         super(MCSStory, self).__init__()
 
         if "mcstories.com" in id:
@@ -30,7 +45,8 @@ class MCSStory(Story):
 
         self.extra = []
 
-        self.chapters = []
+        # (href, number, title, added) for each chapter
+        toc = []
         tab = p.find("table", id="index")
         if tab is not None:
             for i, tr in enumerate(tab.find_all("tr")):
@@ -41,14 +57,40 @@ class MCSStory(Story):
                 name, length, added = tr.find_all("td")
                 a = name.find("a")
                 assert "/" not in a["href"]
-                self.chapters.append(
-                    MCSChapter(futures.get(url + a["href"]), i, name.text, added.text)
-                )
+                toc.append((a["href"], i, name.text, added.text))
         else:
             a = p.find("div", class_="chapter").find("a")
-            self.chapters.append(
-                MCSChapter(futures.get(url + a["href"]), 1, a.text, "")
-            )
+            toc.append((a["href"], 1, a.text, ""))
+
+        if select is not None:
+            toc = select.pick(toc)
+        self.chapters = [
+            MCSChapter(futures.get(url + href), i, title, added)
+            for href, i, title, added in toc
+        ]
+
+
+@register_author(domain="mcstories.com")
+class MCSAuthor(Author):
+    path_re = re.compile(r"^/Authors/[^/]+\.html$")
+    works = None
+
+    def __init__(self, url):
+        self.url = url
+        (p,) = self.get_pages([self.url])
+
+        seen = set()
+        self.works = []
+        for a in p.find_all("a", href=True):
+            m = story_path_re.match(urlparse(urljoin(self.url, a["href"])).path)
+            title = a.text.strip()
+            if m and title and m.group(1) not in not_stories | seen:
+                seen.add(m.group(1))
+                url = "https://mcstories.com/{}/".format(m.group(1))
+                self.works.append(Work(url, title, slugify(title)))
+
+    def __repr__(self):
+        return "MCSAuthor({!r})".format(self.url)
 
 
 class MCSChapter(Chapter):
@@ -1,7 +1,30 @@
+from importlib import import_module
 from urllib.parse import urlparse
 
 _domain_registry = {}
 _prefix_registry = {}
+_author_registry = {}
+_canonical_registry = {}
+
+# Which module registers each domain / prefix, so that only the one a URL
+# needs gets imported. Plugins add to these via declare() or the
+# "make_ebook.sites" / "make_ebook.site_prefixes" entry point groups, whose
+# names are the domain / prefix and whose values are the module.
+_domain_modules = {
+    "archiveofourown.org": ".ao3",
+    "fictionmania.tv": ".fictionmania",
+    "hentai-foundry.com": ".hentai_foundry",
+    "literotica.com": ".literotica",
+    "mcstories.com": ".mcstories",
+    "scribblehub.com": ".scribblehub",
+    "takealemon.com": ".take_a_lemon",
+    "tgstorytime.com": ".tgs",
+}
+_prefix_modules = {
+    "javascript:newPopwin('": ".fictionmania",
+    "javascript:newPopwin": ".tgs",
+}
+_entry_points_loaded = False
 
 
 def register(domain=None, prefix=None):
@@ -23,15 +46,144 @@ def register(domain=None, prefix=None):
     return the_decorator
 
 
-def get_site(path):
-    for pref, cls in _prefix_registry.items():
-        if path.startswith(pref):
-            return cls
+def register_author(domain):
+    def the_decorator(cls):
+        assert domain not in _author_registry
+        _author_registry[domain] = cls
+        return cls
+
+    return the_decorator
+
+
+def register_canonical(domain):
+    """
+    Registers f(url) -> url as the way to canonicalize domain's URLs: every
+    request for one goes out, and is cached and coalesced, under f's form.
+    """
+
+    def the_decorator(f):
+        assert domain not in _canonical_registry
+        _canonical_registry[domain] = f
+        return f
+
+    return the_decorator
+
+
+def rehost(url, scheme, netloc):
+    """
+    url on scheme://netloc instead, if it's on netloc with or without www;
+    other subdomains, e.g. image hosts, are left alone.
+    """
+    r = urlparse(url)
+    bare = netloc[4:] if netloc.startswith("www.") else netloc
+    if r.netloc not in {bare, "www." + bare}:
+        return url
+    return r._replace(scheme=scheme, netloc=netloc).geturl()
+
+
+def canonical_url(url):
+    """
+    The one form of url that's fetched and cached: with a lowercase scheme
+    and host, no fragment, and then whatever its site's canonicalizer does.
+    """
+    r = urlparse(url)
+    if r.scheme.lower() not in {"http", "https"}:
+        return url
+    url = r._replace(
+        scheme=r.scheme.lower(), netloc=r.netloc.lower(), fragment=""
+    ).geturl()
+
+    _load_module_for(url)
+    f = _find_domain(_canonical_registry, url)
+    return url if f is None else f(url)
+
+
+def declare(module, domains=(), prefixes=()):
+    """
+    Say that importing module registers these domains / prefixes.
+    """
+    for domain in domains:
+        _domain_modules[domain] = module
+    for prefix in prefixes:
+        _prefix_modules[prefix] = module
+
 
+def load_all():
+    """
+    Import every known site module, e.g. to warm up a long-running process.
+    """
+    _load_entry_points()
+    for module in set(_domain_modules.values()) | set(_prefix_modules.values()):
+        import_module(module, __package__)
+
+
+def _load_entry_points():
+    global _entry_points_loaded
+    if _entry_points_loaded:
+        return False
+    _entry_points_loaded = True
+
+    from importlib.metadata import entry_points
+
+    eps = entry_points()
+    for group, modules in [
+        ("make_ebook.sites", _domain_modules),
+        ("make_ebook.site_prefixes", _prefix_modules),
+    ]:
+        if hasattr(eps, "select"):
+            found = eps.select(group=group)
+        else:  # python < 3.10
+            found = eps.get(group, [])
+        for ep in found:
+            modules.setdefault(ep.name, ep.value)
+    return True
+
+
+def _find_prefix(registry, path):
+    matches = [pref for pref in registry if path.startswith(pref)]
+    if matches:
+        return registry[max(matches, key=len)]
+    return None
+
+
+def _find_domain(registry, path):
     netloc = urlparse(path).netloc
-    while "." in netloc and netloc not in _domain_registry:
+    while "." in netloc and netloc not in registry:
         _, netloc = netloc.split(".", 1)
-    if netloc in _domain_registry:
-        return _domain_registry[netloc]
+    return registry.get(netloc)
+
+
+def _load_module_for(path):
+    while True:
+        module = _find_prefix(_prefix_modules, path)
+        if module is None:
+            module = _find_domain(_domain_modules, path)
+        if module is not None:
+            import_module(module, __package__)
+            return
+        if not _load_entry_points():
+            return
+
+
+def get_site(path):
+    _load_module_for(path)
+
+    cls = _find_prefix(_prefix_registry, path)
+    if cls is None:
+        cls = _find_domain(_domain_registry, path)
+    if cls is not None:
+        return cls
 
     raise ValueError(f"Couldn't find registered site for {path}")
+
+
+def get_author(path):
+    """
+    The author-listing class for path, or None if it isn't an author page.
+    """
+    _load_module_for(path)
+
+    cls = _find_domain(_author_registry, path)
+    if cls is not None and cls.matches(path):
+        return cls
+    return None
@@ -4,15 +4,28 @@ import warnings
 
 from bs4 import Tag
 
-from ..helpers import cached, futures, gather_bits, hashify, soupify_request
-from .base import Chapter, Extra, Story
-from .registry import register
+from ..helpers import (
+    cache_policy,
+    futures,
+    gather_bits,
+    hashify,
+    slugify,
+    soupify_request,
+)
+from .base import Author, Chapter, Extra, Story, Work, links_signal, revalidate
+from .registry import register, register_author, register_canonical, rehost
 
 
 series_re = re.compile(r"^/series/(\d+)/([^/]+)/")
 chapter_re = re.compile(r"^/read/(\d+)-([^/]+)/chapter/(\d+)/$")
+profile_re = re.compile(r"^/profile/(\d+)/([^/]+)/?$")
+page_re = re.compile(r"[?&]pg=(\d+)")
 series_fmt = "https://www.scribblehub.com/series/{}/{}/"
 sh_chapter_fmt = "https://www.scribblehub.com/read/{}-{}/chapter/{}"
+profile_fmt = "https://www.scribblehub.com/profile/{}/{}/"
+
+cache_policy(r"scribblehub\.com/read/", days=30)
+cache_policy(r"scribblehub\.com/(?:series|profile)/", minutes=10)
 
 _sh_extras = {}
 
@@ -28,7 +41,8 @@ def get_sh_emoji_url(name):
     global emoji_css
     if name not in emoji_map:
         if emoji_css is None:
-            r = cached.get(emoji_css_url)
+            # through futures, so chapters parsed at once share one download
+            r = futures.get(emoji_css_url).result()
             if not r.ok:
                 raise IOError("Error: {}".format(r.status_code))
             emoji_css = r.text
@@ -55,26 +69,22 @@ class ScribbleHubExtra(Extra):
         super(ScribbleHubExtra, self).__init__(url, hashify(url))
 
 
+@register_canonical("scribblehub.com")
+def canonical_scribblehub(url):
+    return rehost(url, "https", "www.scribblehub.com")
+
+
 @register(domain="scribblehub.com")
 class ScribbleHubStory(Story):
     publisher = "scribblehub.com"
     author = chapters = title = None
+    selectable = True
 
-    def __init__(self, id, slug=None):
+    def __init__(self, id, slug=None, select=None):
         super(ScribbleHubStory, self).__init__()
 
         if "scribblehub.com/" in id:
-            r = urlparse(id)
-            assert r.netloc in {"scribblehub.com", "www.scribblehub.com"}
-            m = series_re.match(r.path)
-            if m:
-                id, slug = m.groups()
-            else:
-                m = chapter_re.match(r.path)
-                if m:
-                    id, slug, _ = m.groups()
-                else:
-                    raise ValueError("Can't parse url {!r}".format(id))
+            id, slug = self.parse_url(id)
 
         self.id = int(id)
         self.slug = slug
@@ -86,31 +96,88 @@ class ScribbleHubStory(Story):
         self.cover_img = get_sh_extra(p.select_one(".fic_image img").attrs["src"])
         self.cover_img.attrs["properties"] = "cover-image"
 
-        chaps_ul = soupify_request(
-            futures.post(
-                "https://www.scribblehub.com/wp-admin/admin-ajax.php",
-                data={
-                    "action": "wi_gettocchp",
-                    "strSID": self.id,
-                    "strmypostid": "0",
-                    "strFic": "yes",
-                },
-            )
-        )
+        chaps_ul = soupify_request(self.toc_request(self.id))
+        links = list(reversed(chaps_ul.select(".li_toc a")))
+        if select is not None:
+            links = select.pick(links)
         self.chapters = [
             ScribbleHubChapter(a.attrs["href"], gather_bits([a.attrs["title"]]))
-            for a in reversed(chaps_ul.select(".li_toc a"))
+            for a in links
         ]
 
     def __repr__(self):
         return "ScribbleHubStory({!r})".format(self.id)
 
+    @staticmethod
+    def parse_url(url):
+        r = urlparse(url)
+        assert r.netloc in {"scribblehub.com", "www.scribblehub.com"}
+        m = series_re.match(r.path)
+        if m:
+            return m.groups()
+        m = chapter_re.match(r.path)
+        if m:
+            return m.groups()[:2]
+        raise ValueError("Can't parse url {!r}".format(url))
+
+    @staticmethod
+    def toc_request(id):
+        return futures.post(
+            "https://www.scribblehub.com/wp-admin/admin-ajax.php",
+            data={
+                "action": "wi_gettocchp",
+                "strSID": id,
+                "strmypostid": "0",
+                "strFic": "yes",
+            },
+        )
+
+    @classmethod
+    def change_signal(cls, url):
+        # the series page lists the newest chapters, and unlike the
+        # wi_gettocchp POST it can be revalidated instead of refetched
+        req = futures.get(series_fmt.format(*cls.parse_url(url)), headers=revalidate)
+        return links_signal(req, ".li_toc a")
+
     @property
     def extra(self):
-        extra_urls = set()
+        extras = {self.cover_img.name: self.cover_img}
         for chap in self.chapters:
-            extra_urls.update(chap.get_extra_urls())
-        return [self.cover_img] + [get_sh_extra(url) for url in extra_urls]
+            for x in chap.extra:
+                extras.setdefault(x.name, x)
+        return list(extras.values())
+
+
+@register_author(domain="scribblehub.com")
+class ScribbleHubAuthor(Author):
+    path_re = profile_re
+    works = None
+
+    def __init__(self, url):
+        self.url = profile_fmt.format(*profile_re.match(urlparse(url).path).groups())
+
+        (first,) = self.get_pages([self.url])
+        num_pages = max(
+            (int(page_re.search(a["href"]).group(1)) for a in first("a", href=page_re)),
+            default=1,
+        )
+        pages = [first] + self.get_pages(
+            "{}?pg={}".format(self.url, n) for n in range(2, num_pages + 1)
+        )
+
+        seen = set()
+        self.works = []
+        for p in pages:
+            for a in p.select(".search_title a[href]"):
+                m = series_re.match(urlparse(a["href"]).path)
+                title = a.text.strip()
+                if m and title and m.group(1) not in seen:
+                    seen.add(m.group(1))
+                    url = series_fmt.format(*m.groups())
+                    self.works.append(Work(url, title, slugify(title)))
+
+    def __repr__(self):
+        return "ScribbleHubAuthor({!r})".format(self.url)
 
 
 class ScribbleHubChapter(Chapter):
@@ -139,6 +206,8 @@ class ScribbleHubChapter(Chapter):
     def __repr__(self):
         return "ScribbleHubChapter({!r}, {!r})".format(self.url, self.title)
 
+    pending = property(lambda self: [self.req, self.comments_req])
+
     @property
     def soup(self):
         if not hasattr(self, "_soup"):
@@ -158,6 +227,10 @@ class ScribbleHubChapter(Chapter):
         self.notes_post
         return self.extra_urls
 
+    @property
+    def extra(self):
+        return [get_sh_extra(url) for url in self.get_extra_urls()]
+
     def handle_extras(self, soup):
         for x in soup.find_all(True, {"src": True}):
             if x.attrs["src"].startswith("extra-"):
@@ -1,15 +1,25 @@
 import re
 from urllib.parse import parse_qs, urljoin, urlparse
 
-from ..helpers import futures, gather_bits, soupify_request, stripright
+from ..helpers import cache_policy, futures, gather_bits, soupify_request, stripright
 from .base import Chapter, Extra, Story
-from .registry import register
+from .registry import register, register_canonical, rehost
 
 
 url_fmt = "http://www.tgstorytime.com/viewstory.php?sid={}&chapter={}&ageconsent=ok"
 
 js_re = re.compile(r"location\s*=\s*'(.*)'")
 
+# the first chapter's page carries the chapter list
+cache_policy(r"tgstorytime\.com/viewstory\.php\?sid=\d+&chapter=1&", minutes=10)
+cache_policy(r"tgstorytime\.com/viewstory\.php", days=30)
+
+
+@register_canonical("tgstorytime.com")
+def canonical_tgs(url):
+    # the form url_fmt uses
+    return rehost(url, "http", "www.tgstorytime.com")
+
 
 @register(domain="tgstorytime.com")
 @register(prefix="javascript:newPopwin")
@@ -19,8 +29,11 @@ class TGSStory(Story):
     author = None
     chapters = None
     title = None
+    selectable = True
+    toc_selector = "div.jumpmenu option"
+    toc_attr = "value"
 
-    def __init__(self, id):
+    def __init__(self, id, select=None):
         super().__init__()
 
         id = str(id)
@@ -54,9 +67,13 @@ class TGSStory(Story):
 
         assert set(chapter_titles) == set(range(1, len(chapter_titles) + 1))
 
-        self.chapters = [first_chapter] + [
-            TGSChapter(self.id, n, title=chapter_titles[n])
-            for n in range(2, len(chapter_titles) + 1)
+        # the first chapter is the table of contents, so it's fetched anyway
+        numbers = range(1, len(chapter_titles) + 1)
+        if select is not None:
+            numbers = select.pick(numbers)
+        self.chapters = [
+            first_chapter if n == 1 else TGSChapter(self.id, n, title=chapter_titles[n])
+            for n in numbers
         ]
 
     @property
@@ -75,6 +92,7 @@ class TGSChapter(Chapter):
 
         self.story_id = story_id
         self.chapter_num = chapter_num
+        self.id = f"{story_id}-{chapter_num}"
         self.url = url_fmt.format(story_id, chapter_num)
         self.req = futures.get(self.url)
         self.title = title
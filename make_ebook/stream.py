@@ -0,0 +1,75 @@
+"""
+The library API for streaming: a story's chapters as each one is ready,
+rather than a whole book at the end.
+
+    for chap in make_ebook.iter_chapters(url):
+        store(chap.index, chap.chapter.title, chap.chapter.text)
+
+Stopping early (breaking out of the loop, or closing the iterator) cancels
+the downloads that haven't started yet, unless something else in the
+process is waiting on the same ones.
+"""
+
+import asyncio
+from collections import namedtuple
+
+from .checkpoint import in_arrival_order
+from .metrics import metrics
+from .model import compile_chapter, compile_extra
+from .sites import get_story
+
+
+# index is the chapter's position in the story (or in the selection), from 0;
+# chapter is a model.BookChapter and extra a tuple of model.BookExtras
+StreamedChapter = namedtuple("StreamedChapter", ["index", "chapter", "extra"])
+
+
+def iter_chapters(url, select=None, in_order=False):
+    """
+    Yields a StreamedChapter for each chapter of the story at url as soon as
+    its downloads finish, or in table-of-contents order with in_order. With
+    select, a sites.ChapterSelection, only those chapters are fetched.
+    """
+    story = get_story(url, select=select)
+    items = list(enumerate(story.chapters))
+    arrivals = iter(items) if in_order else in_arrival_order(items)
+    try:
+        for i, chap in arrivals:
+            record = StreamedChapter(
+                i, compile_chapter(chap), tuple(compile_extra(x) for x in chap.extra)
+            )
+            metrics.count("chapters_total")
+            yield record
+    finally:
+        # whatever's still queued is for chapters nobody will ask for now;
+        # these are our own Handles, so shared downloads carry on for others
+        for _, chap in items:
+            for fut in chap.pending:
+                fut.cancel()
+
+
+_done = object()
+
+
+async def aiter_chapters(url, select=None, in_order=False):
+    """
+    iter_chapters as an async iterator; the waiting and parsing happen in
+    the event loop's default executor.
+    """
+    loop = asyncio.get_running_loop()
+    it = iter_chapters(url, select=select, in_order=in_order)
+    step = None
+    try:
+        while True:
+            step = loop.run_in_executor(None, next, it, _done)
+            # shielded, so if we're cancelled step still tells us when the
+            # next() in the executor is over
+            record = await asyncio.shield(step)
+            if record is _done:
+                return
+            yield record
+    finally:
+        # closing a generator that's running in another thread raises
+        if step is not None:
+            await asyncio.wait([step])
+        await loop.run_in_executor(None, it.close)
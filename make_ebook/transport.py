@@ -0,0 +1,247 @@
+"""
+The shared HTTP stack. Importing this builds it, so `helpers` only does that
+the first time something asks for `session`, `cached` or `futures`.
+"""
+
+import copy
+from functools import partial
+import hashlib
+import sys
+from urllib.parse import urlparse
+import weakref
+import zlib
+
+from cachecontrol import CacheControl, CacheControlAdapter, CacheController
+from cachecontrol.caches import FileCache
+from cachecontrol.heuristics import ExpiresAfter
+import requests
+from requests.adapters import HTTPAdapter
+from requests_futures.sessions import FuturesSession
+from urllib3 import HTTPResponse
+from urllib3.util import make_headers
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from .helpers import (
+    Coalescing,
+    cache_ttl,
+    find_site_jar,
+    offline,
+    settings,
+    throttle,
+)
+from .metrics import metrics
+from .sites.registry import canonical_url
+
+
+class ThrottledAdapter(HTTPAdapter):
+    def send(self, request, *args, **kwargs):
+        host = urlparse(request.url).netloc
+        with throttle.slot(host):
+            throttle.wait(host)
+            return super(ThrottledAdapter, self).send(request, *args, **kwargs)
+
+
+def post_key(request):
+    body = request.body or b""
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    return "POST {} {}".format(request.url, hashlib.sha1(body).hexdigest())
+
+
+def wire_size(resp):
+    """
+    The bytes resp's body took on the wire, before any Content-Encoding was
+    undone; its decoded length if that isn't known.
+    """
+    resp.content
+    try:
+        return resp.raw.tell() or len(resp.content)
+    except (AttributeError, OSError):
+        return len(resp.content)
+
+
+# cache hits are answered by CacheControlAdapter before reaching the throttle
+class Adapter(CacheControlAdapter, ThrottledAdapter):
+    def send(self, request, *args, **kwargs):
+        if offline.enabled:
+            resp = self.send_offline(request)
+        else:
+            resp = super(Adapter, self).send(request, *args, **kwargs)
+            if request.method == "POST" and resp.ok and not kwargs.get("stream"):
+                self.store_post(request, resp)
+
+        from_cache = getattr(resp, "from_cache", False)
+        size = 0 if kwargs.get("stream") else wire_size(resp)
+        metrics.request(urlparse(request.url).netloc, from_cache, size)
+        return resp
+
+    def send_offline(self, request):
+        if request.method == "POST":
+            key = post_key(request)
+        else:
+            key = self.controller.cache_url(request.url)
+        data = self.cache.get(key)
+        cached = data and self.controller.serializer.loads(request, data)
+        if not cached:
+            offline.miss(request.url)
+        return self.build_response(request, cached, from_cache=True)
+
+    def store_post(self, request, resp):
+        # POSTs are never answered from the cache online (they're the
+        # ScribbleHub TOC and comments), but are kept for offline builds
+        headers = {
+            k: v
+            for k, v in resp.headers.items()
+            if k.lower()
+            not in {"content-encoding", "content-length", "transfer-encoding"}
+        }
+        raw = HTTPResponse(
+            body=b"",
+            headers=headers,
+            status=resp.status_code,
+            reason=resp.reason,
+            preload_content=False,
+        )
+        data = self.controller.serializer.dumps(request, raw, resp.content)
+        self.cache.set(post_key(request), data)
+
+    def build_response(self, request, response, from_cache=False, **kwargs):
+        cacheable = kwargs.get("cacheable_methods") or self.cacheable_methods
+        if not from_cache and request.method in cacheable:
+            ttl = cache_ttl(request.url)
+            response = ExpiresAfter(seconds=ttl.total_seconds()).apply(response)
+        return super(Adapter, self).build_response(
+            request, response, from_cache=from_cache, **kwargs
+        )
+
+
+class _NoPurge(object):
+    def __init__(self, cache):
+        self.cache = cache
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def delete(self, key):
+        pass
+
+
+class Controller(CacheController):
+    def cached_request(self, request):
+        # CacheController drops stale entries that have no ETag, but we still
+        # want to revalidate those with If-Modified-Since
+        keep = copy.copy(self)
+        keep.cache = _NoPurge(self.cache)
+        return CacheController.cached_request(keep, request)
+
+    def cache_response(self, request, response_or_ref, *args, **kwargs):
+        # the cache key leaves cookies out, so a response that sets a site's
+        # session cookies (ones a SiteJar keeps) mustn't be replayed later
+        response = response_or_ref
+        if isinstance(response, weakref.ReferenceType):
+            response = response()
+        if (
+            response is not None
+            and "set-cookie" in response.headers
+            and find_site_jar(request.url) is not None
+        ):
+            return
+        return super(Controller, self).cache_response(
+            request, response_or_ref, *args, **kwargs
+        )
+
+
+zstd_magic = b"\x28\xb5\x2f\xfd"
+
+
+class CompressedFileCache(FileCache):
+    """
+    A FileCache storing entries zstd-compressed (zlib without zstandard).
+    Entries that don't shrink, e.g. already-gzipped bodies, are stored as is.
+    """
+
+    def get(self, key):
+        data = super(CompressedFileCache, self).get(key)
+        if data is None:
+            return None
+        if data.startswith(zstd_magic):
+            if zstandard is None:  # written where it was installed; refetch
+                return None
+            return zstandard.ZstdDecompressor().decompress(data)
+        if data[:1] == b"\x78":  # zlib header; serialized entries start "cc="
+            return zlib.decompress(data)
+        return data
+
+    def set(self, key, value, *args, **kwargs):
+        if zstandard is not None:
+            packed = zstandard.ZstdCompressor(level=3).compress(value)
+        else:
+            packed = zlib.compress(value)
+        if len(packed) < len(value):
+            value = packed
+        super(CompressedFileCache, self).set(key, value, *args, **kwargs)
+
+
+class Session(requests.Session):
+    # canonicalized here as well as in Coalescing, so that requests made on
+    # `cached` directly share cache entries with everything else
+    def request(self, method, url, *args, **kwargs):
+        return super(Session, self).request(method, canonical_url(url), *args, **kwargs)
+
+
+session = Session()
+# everything urllib3 can decode here: br with brotli, zstd with backports.zstd
+session.headers["Accept-Encoding"] = make_headers(accept_encoding=True)[
+    "accept-encoding"
+]
+cached = CacheControl(
+    session,
+    cache=CompressedFileCache(".webcache"),
+    controller_class=Controller,
+    adapter_class=partial(
+        Adapter,
+        pool_connections=settings["pool_hosts"],
+        pool_maxsize=settings["pool_size"],
+    ),
+)
+futures = Coalescing(FuturesSession(session=cached, max_workers=settings["workers"]))
+
+
+def in_cache(url):
+    """
+    Whether the cache has a response for url, fresh or not.
+    """
+    url = canonical_url(url)
+    adapter = cached.get_adapter(url)
+    return adapter.cache.get(adapter.controller.cache_url(url)) is not None
+
+
+def connection_stats():
+    """
+    (url, requests, new connections) for each host pool still open.
+    """
+    stats = []
+    for adapter in {id(a): a for a in session.adapters.values()}.values():
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            url = "{}://{}:{}".format(pool.scheme, pool.host, pool.port)
+            stats.append((url, pool.num_requests, pool.num_connections))
+    return stats
+
+
+def print_stats(file=sys.stderr):
+    print(
+        "{:<40} {:>8} {:>11} {:>7}".format("host", "requests", "connections", "reused"),
+        file=file,
+    )
+    for url, requests, connections in connection_stats():
+        reused = 1 - connections / requests if requests else 0
+        print(
+            "{:<40} {:>8} {:>11} {:>7.1%}".format(url, requests, connections, reused),
+            file=file,
+        )
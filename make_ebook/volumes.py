@@ -0,0 +1,55 @@
+from collections import namedtuple
+
+
+# either limit may be None; a volume always gets at least one chapter
+VolumeSpec = namedtuple("VolumeSpec", ["chapters", "size"])
+
+
+def volume_name(out_name, number):
+    return "{}-{:02d}".format(out_name, number)
+
+
+def chapter_size(chapter):
+    notes = list(chapter.notes_pre) + list(chapter.notes_post)
+    return sum(
+        len(s.encode("utf-8"))
+        for s in [chapter.title, chapter.text] + [t for n in notes for t in n]
+    )
+
+
+def split_chapters(chapters, spec):
+    """
+    Cuts chapters into volumes front to back, so adding chapters to the end
+    of a story only ever changes its last volume (or starts new ones).
+    """
+    volumes = []
+    current = []
+    size = 0
+    for chapter in chapters:
+        n = chapter_size(chapter) if spec.size else 0
+        if current and (
+            (spec.chapters and len(current) >= spec.chapters)
+            or (spec.size and size + n > spec.size)
+        ):
+            volumes.append(current)
+            current = []
+            size = 0
+        current.append(chapter)
+        size += n
+    if current:
+        volumes.append(current)
+    return volumes
+
+
+def split_story(book, spec):
+    """
+    The volumes of a compiled story, as Books of their own.
+    """
+    return [
+        book.with_chapters(
+            chapters,
+            id="{}-{}".format(book.id, i),
+            title="{}, Volume {}".format(book.title, i),
+        )
+        for i, chapters in enumerate(split_chapters(book.chapters, spec), 1)
+    ]
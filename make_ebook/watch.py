@@ -0,0 +1,157 @@
+"""
+Watch mode: poll a list of stories for new chapters and rebuild the ones
+that changed.
+"""
+
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import heapq
+import json
+import os
+import sys
+import threading
+import time
+from urllib.parse import urlparse
+
+from .batch import already_built, build
+from .helpers import hashify
+from .sites import get_change_signal
+
+
+Watched = namedtuple("Watched", ["url", "out_name"])
+
+
+def read_watchlist(path):
+    """
+    One story per line: a URL, optionally followed by its out_name.
+    Blank lines and lines starting with # are skipped.
+    """
+    watched = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            parts = line.split(None, 1)
+            watched.append(Watched(parts[0], parts[1] if len(parts) > 1 else None))
+    return watched
+
+
+def schedule(watched, interval, host_budget):
+    """
+    (offset, period, story) for each story: when to first poll it, and how
+    often after that. A host's stories are spread evenly over the interval,
+    but no closer together than its budget of polls per minute allows, so
+    busy hosts get longer rounds.
+    """
+    by_host = defaultdict(list)
+    for w in watched:
+        by_host[urlparse(w.url).netloc].append(w)
+
+    offsets = []
+    for host, ws in by_host.items():
+        spacing = max(interval / len(ws), 60.0 / host_budget)
+        period = spacing * len(ws)
+        # hosts start at different points, so they don't all poll at once
+        start = int(hashify(host)[:8], 16) % 1000 / 1000.0 * spacing
+        for i, w in enumerate(ws):
+            offsets.append((start + i * spacing, period, w))
+    return offsets
+
+
+class Watcher(object):
+    def __init__(
+        self,
+        watched,
+        state_path=".watch.json",
+        interval=3600,
+        host_budget=6,
+        jobs=2,
+        **build_kwargs
+    ):
+        self.watched = watched
+        self.state_path = state_path
+        self.interval = interval
+        self.host_budget = host_budget
+        self.build_kwargs = build_kwargs
+        self.pool = ThreadPoolExecutor(max_workers=jobs)
+        self.building = set()
+        self.lock = threading.Lock()
+        self.state = self.load_state()
+
+    def load_state(self):
+        try:
+            with open(self.state_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def save_state(self):
+        with self.lock:
+            tmp = self.state_path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(self.state, f, indent=1, sort_keys=True)
+            os.replace(tmp, self.state_path)
+
+    def poll(self, w):
+        with self.lock:
+            if w.url in self.building:
+                return
+        try:
+            signal = get_change_signal(w.url)
+        except Exception as e:
+            print("ERROR polling {}: {}".format(w.url, e), file=sys.stderr)
+            return
+
+        known = self.state.get(w.url)
+        if known == signal:
+            return
+        if known is None and w.out_name is not None:
+            move_to = self.build_kwargs.get("move_to")
+            formats = self.build_kwargs.get("formats", ["mobi"])
+            if already_built(w.out_name, move_to, formats):
+                # already built before we were watching it
+                with self.lock:
+                    self.state[w.url] = signal
+                self.save_state()
+                return
+
+        print("Changed: {}".format(w.url), file=sys.stderr)
+        with self.lock:
+            self.building.add(w.url)
+        self.pool.submit(self.rebuild, w, signal)
+
+    def rebuild(self, w, signal):
+        try:
+            build(w.url, out_name=w.out_name, update=True, **self.build_kwargs)
+        except (Exception, SystemExit) as e:
+            # the signal isn't saved, so it's tried again next round
+            print("ERROR on {}: {}".format(w.url, e), file=sys.stderr)
+        else:
+            with self.lock:
+                self.state[w.url] = signal
+            self.save_state()
+        finally:
+            with self.lock:
+                self.building.discard(w.url)
+
+    def run(self, once=False):
+        if once:
+            for w in self.watched:
+                self.poll(w)
+            self.pool.shutdown(wait=True)
+            return
+
+        now = time.time()
+        queue = [
+            (now + offset, i, period, w)
+            for i, (offset, period, w) in enumerate(
+                schedule(self.watched, self.interval, self.host_budget)
+            )
+        ]
+        heapq.heapify(queue)
+        while queue:
+            when, i, period, w = heapq.heappop(queue)
+            time.sleep(max(0, when - time.time()))
+            self.poll(w)
+            heapq.heappush(queue, (when + period, i, period, w))
@@ -0,0 +1,254 @@
+"""
+Worker mode: any number of processes, on any number of machines, take build
+jobs from a queue in a shared directory.
+
+The queue is an SQLite database, DIR/queue.sqlite. A worker claims a job by
+taking a lease on it, and keeps renewing the lease while the build runs; a
+job whose lease runs out (its worker died) goes back to whoever claims next.
+The same database spaces out requests to each host across every worker, so
+adding machines doesn't add load on any one site.
+"""
+
+from collections import deque
+from contextlib import contextmanager
+import json
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+
+from .daemon import Job
+
+
+schema = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    url TEXT NOT NULL,
+    out_name TEXT,
+    status TEXT NOT NULL DEFAULT 'queued',
+    worker TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    submitted REAL,
+    started REAL,
+    finished REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+CREATE TABLE IF NOT EXISTS hosts (
+    host TEXT PRIMARY KEY,
+    next_at REAL NOT NULL
+);
+"""
+
+
+class LeaseLost(Exception):
+    pass
+
+
+class JobQueue(object):
+    """
+    Jobs and per-host request slots, shared through one SQLite file. Every
+    call opens its own connection, so a queue can be used from any thread.
+
+    Request slots are taken `slot_batch` at a time and handed out from here,
+    so workers don't queue on the database's write lock for every request.
+    """
+
+    def __init__(self, path, max_attempts=3, slot_batch=8):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.slot_batch = slot_batch
+        self._slots = {}
+        self._slots_lock = threading.Lock()
+        with self._tx() as db:
+            # not executescript(), which would commit the transaction first
+            for statement in schema.split(";"):
+                if statement.strip():
+                    db.execute(statement)
+
+    @contextmanager
+    def _tx(self):
+        db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                yield db
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+        finally:
+            db.close()
+
+    def submit(self, url, out_name=None):
+        """
+        Queues a build of url, unless one is already queued or running;
+        returns the job's id.
+        """
+        with self._tx() as db:
+            row = db.execute(
+                "SELECT id FROM jobs WHERE url = ? AND out_name IS ?"
+                " AND status IN ('queued', 'running')",
+                (url, out_name),
+            ).fetchone()
+            if row is not None:
+                return row[0]
+            cur = db.execute(
+                "INSERT INTO jobs (url, out_name, submitted) VALUES (?, ?, ?)",
+                (url, out_name, time.time()),
+            )
+            return cur.lastrowid
+
+    def claim(self, worker, lease):
+        """
+        Leases the oldest job that's queued or whose lease has run out to
+        worker for `lease` seconds; returns (id, url, out_name), or None if
+        there's nothing to do.
+        """
+        with self._tx() as db:
+            now = time.time()
+            # jobs whose workers died too often are given up on
+            db.execute(
+                "UPDATE jobs SET status = 'failed', error = 'lease expired',"
+                " finished = ? WHERE status = 'running' AND lease_until < ?"
+                " AND attempts >= ?",
+                (now, now, self.max_attempts),
+            )
+            row = db.execute(
+                "SELECT id, url, out_name FROM jobs WHERE status = 'queued'"
+                " OR (status = 'running' AND lease_until < ?) ORDER BY id LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                return None
+            db.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, lease_until = ?,"
+                " attempts = attempts + 1, started = ? WHERE id = ?",
+                (worker, now + lease, now, row[0]),
+            )
+            return row
+
+    def heartbeat(self, job_id, worker, lease):
+        """
+        Extends worker's lease on a job; False if it's no longer worker's.
+        """
+        with self._tx() as db:
+            cur = db.execute(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ?"
+                " AND status = 'running'",
+                (time.time() + lease, job_id, worker),
+            )
+            return cur.rowcount == 1
+
+    def finish(self, job_id, worker, status, result=None, error=None):
+        with self._tx() as db:
+            cur = db.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished = ?"
+                " WHERE id = ? AND worker = ? AND status = 'running'",
+                (status, json.dumps(result), error, time.time(), job_id, worker),
+            )
+            return cur.rowcount == 1
+
+    def reserve(self, host, delay):
+        """
+        Takes the next request slot for host, `delay` seconds after the one
+        before it; returns how long to wait for it.
+        """
+        with self._slots_lock:
+            slots = self._slots.setdefault(host, deque())
+            now = time.time()
+            # a slot that's gone by unused is gone; using it late would bunch
+            # requests up
+            while slots and slots[0] < now:
+                slots.popleft()
+            if not slots:
+                slots.extend(self._reserve_slots(host, delay, self.slot_batch))
+            return max(0, slots.popleft() - now)
+
+    def _reserve_slots(self, host, delay, n):
+        with self._tx() as db:
+            now = time.time()
+            row = db.execute(
+                "SELECT next_at FROM hosts WHERE host = ?", (host,)
+            ).fetchone()
+            at = max(now, row[0]) if row else now
+            db.execute(
+                "INSERT OR REPLACE INTO hosts (host, next_at) VALUES (?, ?)",
+                (host, at + n * delay),
+            )
+        return [at + i * delay for i in range(n)]
+
+    def counts(self):
+        with self._tx() as db:
+            rows = db.execute("SELECT status, count(*) FROM jobs GROUP BY status")
+            return dict(rows.fetchall())
+
+
+def queue_path(shared_dir):
+    return os.path.join(shared_dir, "queue.sqlite")
+
+
+def default_worker_id():
+    return "{}:{}".format(socket.gethostname(), os.getpid())
+
+
+def run_claimed(queue, claimed, worker, lease, move_to=None):
+    job_id, url, out_name = claimed
+    job = Job(url, out_name=out_name, move_to=move_to)
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(lease / 3.0):
+            if not queue.heartbeat(job_id, worker, lease):
+                print("Lost the lease on {}".format(url), file=sys.stderr)
+                return
+
+    def check():
+        # a worker whose lease ran out may have had the job taken over
+        if not queue.heartbeat(job_id, worker, lease):
+            raise LeaseLost("another worker has taken over {}".format(url))
+
+    job.before_write = check
+    beater = threading.Thread(target=beat, daemon=True)
+    beater.start()
+    try:
+        job.run()
+    finally:
+        stop.set()
+        beater.join()
+    if queue.finish(job_id, worker, job.status, job.result, job.error):
+        print("{}: {}".format(job.status.capitalize(), url), file=sys.stderr)
+
+
+def work(queue, move_to=None, jobs=1, lease=300, poll=10, drain=False, worker=None):
+    """
+    Claims and builds jobs from queue, `jobs` at a time, until interrupted;
+    with drain, until the queue is empty instead.
+    """
+    if worker is None:
+        worker = default_worker_id()
+
+    def loop(n):
+        me = "{}/{}".format(worker, n)
+        while True:
+            claimed = queue.claim(me, lease)
+            if claimed is None:
+                if drain:
+                    return
+                time.sleep(poll)
+                continue
+            run_claimed(queue, claimed, me, lease, move_to=move_to)
+
+    threads = [
+        threading.Thread(target=loop, args=(n,), daemon=True) for n in range(jobs)
+    ]
+    for t in threads:
+        t.start()
+    # joined with a timeout so ^C still gets through
+    while any(t.is_alive() for t in threads):
+        for t in threads:
+            t.join(1)
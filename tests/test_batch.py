@@ -0,0 +1,37 @@
+import pytest
+
+from make_ebook import batch, transport
+from make_ebook.sites.base import Work
+from make_ebook.worker import LeaseLost
+
+
+class FakeStory(object):
+    chapters = ()
+
+    def __init__(self, url):
+        self.default_out_name = url.rsplit("/", 1)[-1]
+
+
+def test_a_before_write_abort_stops_every_work(tmp_path, monkeypatch):
+    built = []
+
+    def build_story(story, url, before_write=None, **kwargs):
+        if url.endswith("/bad"):
+            raise IOError("download failed")
+        before_write()
+        built.append(url)
+
+    def before_write():
+        if built:
+            raise LeaseLost("taken over")
+
+    monkeypatch.setattr(transport, "in_cache", lambda url: False)
+    monkeypatch.setattr(batch, "fetch_story", lambda url, **kw: (FakeStory(url), ()))
+    monkeypatch.setattr(batch, "build_story", build_story)
+    works = [
+        Work("https://example.com/{}".format(name), name, name)
+        for name in ["bad", "a", "b", "c"]
+    ]
+    with pytest.raises(LeaseLost):
+        batch.build_works(works, move_to=str(tmp_path), before_write=before_write)
+    assert built == ["https://example.com/a"]
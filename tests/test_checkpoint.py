@@ -0,0 +1,113 @@
+import os
+
+import pytest
+
+from make_ebook import checkpoint
+from make_ebook.checkpoint import Job, Unsaved, checkpointed
+
+
+class FakeExtra(object):
+    fail = False
+
+    def __init__(self, url, name=None):
+        self.url = url
+        base = os.path.basename(url)
+        stem, ext = os.path.splitext(base)
+        self.id = "extra-{}".format(name or stem)
+        self.name = "extra-{}{}".format(name or stem, ext)
+        self.attrs = {}
+        self.mimetype = "image/png"
+
+    @property
+    def content(self):
+        if FakeExtra.fail:
+            raise IOError("Error on {}: 503".format(self.url))
+        return b"png of " + self.url.encode("ascii")
+
+
+class FakeChapter(object):
+    pending = []
+    notes_pre = notes_post = ()
+    toc_extra = ""
+
+    def __init__(self, n, extra=()):
+        self.id = "c{}".format(n)
+        self.title = "Chapter {}".format(n)
+        self.text = "<p>Text of chapter {}</p>".format(n)
+        self.extra = list(extra)
+
+
+class FakeStory(object):
+    """
+    Like TGSStory and ScribbleHubStory, its extras are its chapters'.
+    """
+
+    title = "A Story"
+    author = "Someone"
+    publisher = "example.com"
+    id = "s"
+    default_out_name = "a-story"
+
+    def __init__(self, chapters):
+        self.chapters = chapters
+
+    @property
+    def extra(self):
+        return [x for chap in self.chapters for x in chap.extra]
+
+
+@pytest.fixture
+def fake_extra(monkeypatch):
+    monkeypatch.setattr(checkpoint, "Extra", FakeExtra)
+    monkeypatch.setattr(FakeExtra, "fail", False)
+
+
+def make_story():
+    # named unlike its URL's basename, as ScribbleHub's are
+    cover = FakeExtra("https://example.com/img/1234.png", name="cover")
+    return FakeStory([FakeChapter(1, [cover]), FakeChapter(2)])
+
+
+def test_round_trip(tmp_path, fake_extra):
+    saved = checkpointed(make_story(), str(tmp_path / "job"))
+    assert [c.text for c in saved.chapters] == [
+        "<p>Text of chapter 1</p>",
+        "<p>Text of chapter 2</p>",
+    ]
+    (x,) = saved.extra
+    assert x.name == "extra-cover.png"
+    assert x.mimetype == "image/png"
+    assert x.content == b"png of https://example.com/img/1234.png"
+
+
+def test_resume_refetches_failed_extra(tmp_path, fake_extra):
+    job_dir = str(tmp_path / "job")
+    FakeExtra.fail = True
+    with pytest.raises(IOError):
+        checkpointed(make_story(), job_dir)
+    assert Job(job_dir).saved_chapters() == [0, 1]
+
+    # the chapters come back from the job, their extra refetched from its URL
+    FakeExtra.fail = False
+    story = make_story()
+    story.chapters = []
+    saved = checkpointed(story, job_dir, resume=True, skipped=[0, 1])
+    assert [c.id for c in saved.chapters] == ["c1", "c2"]
+    (x,) = saved.extra
+    assert x.name == "extra-cover.png"
+    assert x.content == b"png of https://example.com/img/1234.png"
+
+
+def test_resume_fetches_only_unsaved(tmp_path, fake_extra):
+    job_dir = str(tmp_path / "job")
+    job = Job(job_dir)
+    job.save_chapter(0, FakeChapter(1))
+    job.save_chapter(2, FakeChapter(3))
+
+    select = Unsaved(None, job.saved_chapters())
+    toc = [FakeChapter(n) for n in range(1, 5)]
+    picked = select.pick(toc)
+    assert [c.id for c in picked] == ["c2", "c4"]
+
+    saved = checkpointed(FakeStory(picked), job_dir, resume=True, skipped=[0, 2])
+    assert [c.id for c in saved.chapters] == ["c1", "c2", "c3", "c4"]
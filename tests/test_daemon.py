@@ -0,0 +1,33 @@
+import threading
+import time
+
+from make_ebook import daemon
+
+
+def test_submit_dedupes_running_urls_and_prunes_finished(monkeypatch):
+    gate = threading.Event()
+
+    def run(job):
+        job.status = "running"
+        gate.wait(5)
+        job.status = "done"
+
+    monkeypatch.setattr(daemon.Job, "run", run)
+    server = daemon.Server(("127.0.0.1", 0), jobs=1, keep=1)
+    try:
+        a = server.submit("https://example.com/a")
+        assert server.submit("https://example.com/a") is a
+        b = server.submit("https://example.com/b")
+        gate.set()
+        deadline = time.time() + 5
+        while b.status != "done" and time.time() < deadline:
+            time.sleep(0.01)
+        assert a.status == b.status == "done"
+
+        c = server.submit("https://example.com/c")
+        assert c is not a
+        assert list(server.jobs) == [b.id, c.id]
+    finally:
+        gate.set()
+        server.pool.shutdown(wait=True)
+        server.server_close()
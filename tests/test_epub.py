@@ -0,0 +1,61 @@
+import os
+import zipfile
+
+from make_ebook.formats.epub import doc_id, make_epub
+from make_ebook.model import Book, BookChapter, intern_notes
+
+
+def chapter(n, text=None):
+    text = "<p>Chapter {} text.</p>".format(n) if text is None else text
+    return BookChapter("c{}".format(n), "Chapter {}".format(n), text, "", (), ())
+
+
+def book(chapters):
+    notes, note_refs = intern_notes(chapters)
+    return Book("b", "B", "A", "example.com", "b", chapters, (), notes, note_refs)
+
+
+def names(path):
+    with zipfile.ZipFile(path) as zf:
+        return zf.namelist()
+
+
+def test_update_appends_new_chapters(tmp_path):
+    out = str(tmp_path / "b")
+    path = make_epub(book((chapter(1), chapter(2))), out_name=out)
+    before = names(path)
+    one, two, three = chapter(1), chapter(2), chapter(3)
+
+    make_epub(book((one, two, three)), out_name=out, update=True)
+    after = names(path)
+    # appended: what was there before the tail stays where it was
+    assert after[: len(before) - 3] == before[: len(before) - 3]
+    assert not os.path.exists(path + ".tmp")
+    with zipfile.ZipFile(path) as zf:
+        assert zf.testzip() is None
+        opf = zf.read("OEBPS/content.opf").decode("utf-8")
+    for chap in (one, two, three):
+        assert '<item id="{}"'.format(doc_id(chap)) in opf
+        assert '<itemref idref="{}"'.format(doc_id(chap)) in opf
+    spine = opf[opf.index("<spine") :]
+    assert spine.index(doc_id(two)) < spine.index(doc_id(three))
+
+
+def test_update_rebuilds_when_a_chapter_changed_or_went(tmp_path):
+    out = str(tmp_path / "b")
+    path = make_epub(book((chapter(1), chapter(2))), out_name=out)
+    with zipfile.ZipFile(path) as zf:
+        first = zf.infolist()[3]
+
+    edited = book((chapter(1, "<p>Edited.</p>"), chapter(2)))
+    make_epub(edited, out_name=out, update=True)
+    with zipfile.ZipFile(path) as zf:
+        assert zf.testzip() is None
+        assert zf.infolist()[3].filename == first.filename
+        assert b"Edited." in zf.read(first.filename)
+
+    make_epub(book((chapter(2),)), out_name=out, update=True)
+    with zipfile.ZipFile(path) as zf:
+        assert zf.testzip() is None
+        assert first.filename not in zf.namelist()
+        assert doc_id(chapter(1)) not in zf.read("OEBPS/content.opf").decode("utf-8")
@@ -0,0 +1,98 @@
+import random
+import struct
+
+import pytest
+
+from make_ebook.formats import mobi_writer
+from make_ebook.formats.palmdoc import compress, decompress
+
+
+def random_texts():
+    rng = random.Random(1234)
+    yield b""
+    yield bytes(range(256))
+    for _ in range(50):
+        n = rng.randrange(1, mobi_writer.record_size + 1)
+        yield bytes(rng.randrange(256) for _ in range(n))
+    for _ in range(50):
+        # markup-like: repetitive, spaces before letters, some UTF-8
+        words = ["<p>", "</p>", " the", " café", " ☃", " lorem", "\n", "ipsum"]
+        text = "".join(rng.choice(words) for _ in range(rng.randrange(1, 900)))
+        yield text.encode("utf-8")[: mobi_writer.record_size]
+
+
+@pytest.mark.parametrize("data", list(random_texts()))
+def test_palmdoc_round_trip(data):
+    assert decompress(compress(data)) == data
+
+
+def read_pdb(raw):
+    (n,) = struct.unpack_from(">H", raw, 76)
+    offsets = [struct.unpack_from(">I", raw, 78 + 8 * i)[0] for i in range(n)]
+    offsets.append(len(raw))
+    return [raw[offsets[i] : offsets[i + 1]] for i in range(n)]
+
+
+def text_of(record):
+    # the trailing bytes repeat the start of the next record, finishing a
+    # character this one cuts in two; their count is the last byte
+    tail = record[-1] & 3
+    return decompress(record[: -1 - tail])
+
+
+def test_record_layout(tmp_path):
+    body = "".join(
+        '<p id="p{0}">Paragraph {0}, café ☃ <a href="#p0">back</a></p>'.format(i)
+        for i in range(600)
+    )
+    html = (
+        "<html><head><title>T</title></head><body>"
+        '<img src="extra-cover.png"/><img src="extra-anim.webp"/>'
+        + body
+        + "</body></html>"
+    )
+    images = [("extra-cover.png", b"PNG" * 10), ("extra-map.gif", b"GIF" * 7)]
+    meta = {"title": "T", "author": "A", "publisher": "example.com"}
+    path = str(tmp_path / "t.mobi")
+    mobi_writer.write_mobi(path, html, meta, images=images, cover=0)
+
+    with open(path, "rb") as f:
+        raw = f.read()
+    assert raw[60:68] == b"BOOKMOBI"
+    records = read_pdb(raw)
+    head = records[0]
+
+    compression, _, text_length, n_text, size = struct.unpack_from(">HHIHH", head, 0)
+    assert (compression, size) == (2, mobi_writer.record_size)
+    assert head[16:20] == b"MOBI"
+    text = b"".join(text_of(r) for r in records[1 : n_text + 1])
+    assert len(text) == text_length
+    assert n_text == -(-text_length // mobi_writer.record_size)
+
+    (first_extra,) = struct.unpack_from(">I", head, 80)
+    (first_image,) = struct.unpack_from(">I", head, 108)
+    first_content, last_content = struct.unpack_from(">HH", head, 192)
+    fcis, _, flis, _ = struct.unpack_from(">IIII", head, 200)
+    assert first_extra == first_image == n_text + 1
+    assert records[first_image : first_image + 2] == [data for _, data in images]
+    assert (first_content, last_content) == (1, n_text + 2)
+    assert records[flis][:4] == b"FLIS"
+    assert records[fcis][:4] == b"FCIS"
+    assert records[-1] == mobi_writer.eof_record
+    assert len(records) == n_text + 2 + 4
+
+    # the image that wasn't stored is left out rather than left dangling
+    assert b'recindex="00001"' in text
+    assert b"extra-anim.webp" not in text
+    assert b'href="#' not in text
+
+
+def test_records_split_inside_a_character():
+    # a record boundary three bytes into a four-byte character
+    text = b"x" * (mobi_writer.record_size - 1) + "😀".encode("utf-8") * 2
+    records = mobi_writer.text_records(text)
+    assert len(records) == 2
+    tail = records[0][-1] & 3
+    assert tail == 3
+    assert records[0][-1 - tail : -1] == text[mobi_writer.record_size :][:3]
+    assert b"".join(text_of(r) for r in records) == text
@@ -0,0 +1,40 @@
+from make_ebook.model import Book, BookChapter, BookExtra, intern_notes
+from make_ebook.volumes import VolumeSpec, split_story
+
+
+def chapter(n, text="", notes_pre=(), notes_post=()):
+    return BookChapter(
+        "c{}".format(n), "Chapter {}".format(n), text, "", notes_pre, notes_post
+    )
+
+
+def extra(name, cover=False):
+    attrs = (("properties", "cover-image"),) if cover else ()
+    return BookExtra(name, name, "image/png", attrs, None)
+
+
+def book(chapters, extras):
+    notes, note_refs = intern_notes(chapters)
+    return Book("b", "B", "A", "example.com", "b", chapters, extras, notes, note_refs)
+
+
+def test_volume_extras_include_those_in_notes():
+    chapters = [
+        chapter(1, '<img src="extra-a.png"/>'),
+        chapter(2, "", notes_post=(("Art", '<img src="extra-b.png"/>'),)),
+    ]
+    extras = (extra("extra-cover.png", cover=True), extra("extra-a.png"))
+    extras += (extra("extra-b.png"),)
+    one, two = split_story(book(chapters, extras), VolumeSpec(1, None))
+    assert [x.name for x in one.extra] == ["extra-cover.png", "extra-a.png"]
+    assert [x.name for x in two.extra] == ["extra-cover.png", "extra-b.png"]
+
+
+def test_repeated_notes_are_kept_once_with_distinct_sources():
+    news = ("News", "<p>Out now!</p>")
+    chapters = [chapter(1, notes_pre=(news, news)), chapter(2, notes_post=(news,))]
+    notes, refs = intern_notes(chapters)
+    assert len(notes) == 1
+    sources = [r.source for c in chapters for both in refs[c.id] for r in both]
+    assert len(sources) == len(set(sources)) == 3
+    assert notes[0].source == sources[0]
@@ -0,0 +1,81 @@
+import argparse
+from concurrent.futures import Future
+from datetime import timedelta
+
+import pytest
+
+from make_ebook.cli import parse_chapters
+from make_ebook.sites.base import ChapterSelection
+
+
+def test_chapter_selection_picks_by_position():
+    items = list(range(1, 21))
+    assert ChapterSelection("1,3,10-12").pick(items) == [1, 3, 10, 11, 12]
+    assert ChapterSelection("-3").pick(items) == [1, 2, 3]
+    assert ChapterSelection("18-").pick(items) == [18, 19, 20]
+
+
+@pytest.mark.parametrize("spec", ["", "5,", "1-3,,10-", "-", "3-1", "0", "x"])
+def test_bad_chapter_selections_are_rejected(spec):
+    with pytest.raises(argparse.ArgumentTypeError):
+        parse_chapters(spec)
+
+
+def test_selection_past_the_end_picks_nothing_and_says_so():
+    with pytest.raises(ValueError):
+        ChapterSelection("500-550").pick(list(range(10)))
+
+
+class FakeResponse(object):
+    ok = True
+
+    def __init__(self, content):
+        self.content = content
+
+
+class FakeFutures(object):
+    def __init__(self, pages):
+        self.pages = pages
+        self.requested = []
+
+    def get(self, url):
+        self.requested.append(url)
+        fut = Future()
+        fut.set_result(FakeResponse(self.pages.get(url, b"")))
+        return fut
+
+
+def test_literotica_pending_reads_the_page_count_off_the_first_page(monkeypatch):
+    from make_ebook.sites import literotica
+
+    url = "https://www.literotica.com/s/a-story"
+    first = b'<span class="b-pager-caption-t">3 Pages:</span>'
+    fake = FakeFutures({url + "?page=1": first})
+    monkeypatch.setattr(literotica, "futures", fake)
+
+    story = literotica.LitStory(url)
+    assert len(story.pending) == 3
+    assert fake.requested == [url + "?page={}".format(n) for n in [1, 2, 3]]
+
+
+def test_ao3_urls_have_one_spelling():
+    from make_ebook.sites import ao3
+    from make_ebook.sites.registry import canonical_url
+
+    site = "https://archiveofourown.org"
+    full = ao3.full_fmt.format(123)
+    assert canonical_url(full) == full
+    assert canonical_url(site + "/works/123?view_full_work=true") == full
+    assert canonical_url(ao3.work_fmt.format(123)) == ao3.work_fmt.format(123)
+    chap = ao3.chap_fmt.format(123, 456)
+    assert canonical_url(site + "/works/123/chapters/456") == chap
+
+
+def test_hentai_foundry_chapters_are_cached_longer_than_stories():
+    from make_ebook.helpers import cache_ttl
+    import make_ebook.sites.hentai_foundry  # registers its cache policies
+
+    story = "https://www.hentai-foundry.com/stories/user/Someone/123/A-Story"
+    chapter = story + "/4567/Chapter-One"
+    assert cache_ttl(chapter) == timedelta(days=30)
+    assert cache_ttl(story) == timedelta(minutes=10)
@@ -0,0 +1,91 @@
+import asyncio
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+import threading
+
+import pytest
+
+from make_ebook import stream
+from make_ebook.helpers import Coalescing
+
+
+class FakeFutures(object):
+    """
+    Stands in for a FuturesSession; every request waits for `go`.
+    """
+
+    def __init__(self):
+        self.go = threading.Event()
+        self.pool = ThreadPoolExecutor(max_workers=1)
+        self.requests = []
+
+    def request(self, method, url, **kwargs):
+        self.requests.append(url)
+        return self.pool.submit(lambda: self.go.wait(5) and url)
+
+
+def test_cancelling_one_share_leaves_the_others():
+    fake = FakeFutures()
+    futures = Coalescing(fake)
+    blocker = futures.get("http://example.com/busy")  # holds the one thread
+    a = futures.get("http://example.com/x")
+    b = futures.get("http://example.com/x")
+    assert fake.requests == ["http://example.com/busy", "http://example.com/x"]
+
+    assert a.cancel()
+    fake.go.set()
+    assert b.result(5) == "http://example.com/x"
+    assert blocker.result(5) == "http://example.com/busy"
+    with pytest.raises(CancelledError):
+        a.result()
+
+
+def test_cancelling_every_share_cancels_the_download():
+    fake = FakeFutures()
+    futures = Coalescing(fake)
+    futures.get("http://example.com/busy")
+    a = futures.get("http://example.com/x")
+    b = futures.get("http://example.com/x")
+    a.cancel()
+    b.cancel()
+    fake.go.set()
+    # a new request isn't handed the cancelled download
+    assert futures.get("http://example.com/x").result(5) == "http://example.com/x"
+    assert fake.requests.count("http://example.com/x") == 2
+
+
+class SlowChapter(object):
+    pending = []
+    notes_pre = notes_post = extra = ()
+    toc_extra = ""
+    title = "Chapter"
+
+    def __init__(self, n, gate):
+        self.id = n
+        self.gate = gate
+
+    @property
+    def text(self):
+        self.gate.wait(5)
+        return "<p>text</p>"
+
+
+class SlowStory(object):
+    def __init__(self, gate):
+        self.chapters = [SlowChapter(n, gate) for n in range(3)]
+
+
+def test_cancelled_aiter_waits_for_the_running_step(monkeypatch):
+    gate = threading.Event()
+    monkeypatch.setattr(stream, "get_story", lambda url, select=None: SlowStory(gate))
+
+    async def main():
+        it = stream.aiter_chapters("http://example.com/s", in_order=True)
+        task = asyncio.ensure_future(it.__anext__())
+        await asyncio.sleep(0.1)  # next() is now blocked in the executor
+        task.cancel()
+        asyncio.get_running_loop().call_later(0.1, gate.set)
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await it.aclose()
+
+    asyncio.run(main())
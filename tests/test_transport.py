@@ -0,0 +1,22 @@
+import pytest
+
+transport = pytest.importorskip("make_ebook.transport")
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return transport.CompressedFileCache(str(tmp_path / "cache"))
+
+
+def test_compressed_round_trip(cache):
+    body = b"cc=4," + b"<p>the same markup again</p>" * 200
+    cache.set("k", body)
+    assert cache.get("k") == body
+
+
+def test_zstd_entry_without_zstandard_is_a_miss(cache, monkeypatch):
+    if transport.zstandard is None:
+        pytest.skip("needs zstandard to write the entry")
+    cache.set("k", b"cc=4," + b"x" * 1000)
+    monkeypatch.setattr(transport, "zstandard", None)
+    assert cache.get("k") is None
@@ -0,0 +1,36 @@
+import time
+
+import pytest
+
+from make_ebook.worker import JobQueue, LeaseLost, run_claimed
+
+
+def test_reserved_slots_are_spaced_across_queues(tmp_path):
+    path = str(tmp_path / "queue.sqlite")
+    a, b = JobQueue(path, slot_batch=4), JobQueue(path, slot_batch=4)
+    start = time.time()
+    slots = []
+    for q in [a, b, a, b, a, b]:
+        slots.append(start + q.reserve("example.com", 10))
+    slots.sort()
+    gaps = [y - x for x, y in zip(slots, slots[1:])]
+    assert all(gap > 9.9 for gap in gaps)
+
+
+def test_lost_lease_stops_the_build_before_writing(tmp_path, monkeypatch):
+    queue = JobQueue(str(tmp_path / "queue.sqlite"))
+    queue.submit("https://example.com/story")
+    claimed = queue.claim("old", lease=0)
+    queue.claim("new", lease=60)  # the old worker's lease ran out
+
+    stopped = []
+
+    def run(job):
+        with pytest.raises(LeaseLost):
+            job.before_write()
+        stopped.append(job.url)
+
+    monkeypatch.setattr("make_ebook.daemon.Job.run", run)
+    run_claimed(queue, claimed, "old", lease=60)
+    assert stopped == ["https://example.com/story"]
+    assert queue.counts() == {"running": 1}